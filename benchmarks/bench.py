@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# Benchmarks host-monitor on simulated hosts (probe_backend: fake), no network or display needed:
+#
+#   python benchmarks/bench.py [--hosts 10 100 1000 10000] [--duration 10] [--headless] [--history]
+#
+# Each size runs in a fresh process with its own HOME (config) and the offscreen Qt platform and reports
+# startup time (until every host has a state), steady-state CPU and RSS per host, probes and state change
+# events per second, and probe-to-repaint latency: state change event until the model is updated for all hosts,
+# and until the row is painted for the hosts visible in the main window.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, SUPPRESS
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_address(i):
+    # 10% of hosts flap, 1% have periodic outages, all lose 0.5% of pings
+    address = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}#latency={5 + i % 45},jitter=2,loss=0.005"
+    if i % 10 == 0:
+        address += f",flap={20 + i % 7}"
+    elif i % 100 == 1:
+        address += ",outage=30:5"
+    return address
+
+
+def write_config(home, hosts, history):
+    groups = [{'hosts': [{'type': 'internet-monitor', 'address': fake_address(0)}]}]
+    group_size = 50
+    for start in range(1, hosts, group_size):
+        groups.append({'hosts': [{'type': 'host', 'name': f"host{i}", 'address': fake_address(i)}
+                                 for i in range(start, min(start + group_size, hosts))]})
+    config = {
+        'settings': {
+            'probe_backend': 'fake',
+            'probe_rate_limit': max(200, 4 * hosts),  # never the bottleneck, probes are not sent anywhere
+            'history_dir': os.path.join(home, 'history') if history else '',
+            'config_reload': False,
+        },
+        'groups': groups,
+    }
+    with open(os.path.join(home, '.host-monitor'), 'w') as file:
+        json.dump(config, file)  # JSON is YAML
+
+
+def rss():
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)] if values else float('nan')
+
+
+def worker(options):
+    # runs inside the benchmarked process
+    base_rss = rss()
+    start = time.monotonic()
+    sys.argv = ['host-monitor'] + (['--headless'] if options.headless else [])
+    sys.path.insert(0, root)
+
+    from host_monitor import events
+    from host_monitor.icmp import get_engine
+
+    event_times = {}
+    pending_paints = {}
+    latencies = []  # state change event until the model is updated (repaint scheduled)
+    paint_latencies = []  # state change event until the row is painted, only rows in the viewport are painted
+    counters = {'events': 0}
+
+    def state_changed(host, up):
+        counters['events'] += 1
+        event_times.setdefault(host.id, time.monotonic())
+
+    events.state_changed.subscribe(state_changed)
+
+    if options.headless:
+        from host_monitor.monitor import Monitor
+        monitor = Monitor()
+        monitor.start()
+        app = None
+    else:
+        from host_monitor import gui
+        monitor = gui.gui.monitor
+        app = gui.application
+        set_up = gui.HostListModel.set_up
+        paint = gui.HostDelegate.paint
+
+        def timed_set_up(model, host_id, value):
+            set_up(model, host_id, value)
+            event_time = event_times.pop(host_id, None)
+            if event_time is not None:
+                latencies.append(time.monotonic() - event_time)
+                pending_paints[host_id] = event_time
+
+        def timed_paint(delegate, painter, option, index):
+            paint(delegate, painter, option, index)
+            event_time = pending_paints.pop(index.model().rows[index.row()], None)
+            if event_time is not None:
+                paint_latencies.append(time.monotonic() - event_time)
+
+        gui.HostListModel.set_up = timed_set_up
+        gui.HostDelegate.paint = timed_paint
+        gui.gui.restore()  # the main window starts minimized
+
+    def wait(seconds, condition=lambda: False):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end and not condition():
+            if app:
+                app.processEvents()
+            time.sleep(0.005)
+
+    hosts = list(monitor.hosts.values())
+    wait(options.timeout, lambda: all(host.state is not None for host in hosts))
+    startup = time.monotonic() - start
+    started = sum(host.state is not None for host in hosts)
+
+    wait(2)  # let the startup burst settle
+    engine = get_engine()
+    sent, events_count = engine.sent, counters['events']
+    for collected in (event_times, pending_paints, latencies, paint_latencies):
+        collected.clear()
+    cpu = time.process_time()
+    steady_start = time.monotonic()
+    wait(options.duration)
+    elapsed = time.monotonic() - steady_start
+    cpu = time.process_time() - cpu
+
+    used_rss = rss() - base_rss
+    return {
+        'hosts': len(hosts),
+        'started': started,
+        'startup_s': startup,
+        'cpu_percent': 100 * cpu / elapsed,
+        'rss_mb': used_rss / 2 ** 20,
+        'rss_kb_per_host': used_rss / 1024 / len(hosts),
+        'probes_per_s': (engine.sent - sent) / elapsed,
+        'events_per_s': (counters['events'] - events_count) / elapsed,
+        'update_p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'update_p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'repaint_p50_ms': percentile(paint_latencies, 50) * 1000 if paint_latencies else None,
+        'repaint_p95_ms': percentile(paint_latencies, 95) * 1000 if paint_latencies else None,
+    }
+
+
+columns = (
+    ('hosts', "hosts", "{:d}"),
+    ('startup_s', "startup s", "{:.2f}"),
+    ('cpu_percent', "cpu %", "{:.1f}"),
+    ('rss_mb', "rss MB", "{:.1f}"),
+    ('rss_kb_per_host', "kB/host", "{:.1f}"),
+    ('probes_per_s', "probes/s", "{:.0f}"),
+    ('events_per_s', "events/s", "{:.1f}"),
+    ('update_p50_ms', "update p50 ms", "{:.1f}"),
+    ('update_p95_ms', "update p95 ms", "{:.1f}"),
+    ('repaint_p50_ms', "repaint p50 ms", "{:.1f}"),
+    ('repaint_p95_ms', "repaint p95 ms", "{:.1f}"),
+)
+
+
+def print_row(values):
+    print("  ".join(f"{value:>{max(len(title), 8)}}" for value, (_, title, _) in zip(values, columns)), flush=True)
+
+
+def main():
+    parser = ArgumentParser(description="host-monitor benchmarks on simulated hosts")
+    parser.add_argument('--hosts', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--duration', type=float, default=10, help="seconds of steady state measured")
+    parser.add_argument('--timeout', type=float, default=120, help="maximum startup time")
+    parser.add_argument('--headless', action='store_true', help="benchmark the daemon instead of the GUI")
+    parser.add_argument('--history', action='store_true', help="keep history files (in a temporary directory)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON lines")
+    parser.add_argument('--worker', action='store_true', help=SUPPRESS)
+    options = parser.parse_args()
+
+    if options.worker:
+        print(json.dumps(worker(options)), flush=True)
+        os._exit(0)  # do not wait for probe threads
+
+    if not options.json:
+        print_row([title for _, title, _ in columns])
+    for hosts in options.hosts:
+        with tempfile.TemporaryDirectory() as home:
+            write_config(home, hosts, options.history)
+            env = dict(os.environ, HOME=home, QT_QPA_PLATFORM='offscreen')
+            command = [sys.executable, __file__, '--worker', '--hosts', str(hosts),
+                       '--duration', str(options.duration), '--timeout', str(options.timeout)]
+            command += ['--headless'] if options.headless else []
+            result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    encoding='utf8')
+            lines = result.stdout.strip().splitlines()
+            if result.returncode or not lines:
+                print(f"{hosts} hosts: benchmark failed (exit code {result.returncode})\n{result.stderr}",
+                      file=sys.stderr)
+                continue
+            results = json.loads(lines[-1])
+            if options.json:
+                print(json.dumps(results), flush=True)
+            else:
+                print_row([fmt.format(results[key]) if results[key] is not None else "-"
+                           for key, _, fmt in columns])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import socket
+import struct
+from threading import Thread, Lock, Condition
+from time import sleep
+
+from host_monitor.events import Observable
+
+NETLINK_ROUTE = 0
+RTMGRP_IPV4_IFADDR = 0x10
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+nlmsghdr = struct.Struct('=IHHII')  # length, type, flags, sequence, pid
+ifaddrmsg = struct.Struct('=BBBBI')  # family, prefix length, flags, scope, interface index
+rtattr = struct.Struct('=HH')  # length, type
+
+service_lock = Lock()
+service = None
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def parse_address(message):
+    family, _, _, _, index = ifaddrmsg.unpack_from(message)
+    if family != socket.AF_INET:
+        return None
+    attributes = {}
+    offset = align(ifaddrmsg.size)
+    while offset + rtattr.size <= len(message):
+        length, type = rtattr.unpack_from(message, offset)
+        if length < rtattr.size:
+            break
+        attributes[type] = message[offset + rtattr.size:offset + length]
+        offset += align(length)
+    # IFA_LOCAL is the local address on point-to-point links (VPN tunnels), IFA_ADDRESS the peer
+    address = attributes.get(IFA_LOCAL) or attributes.get(IFA_ADDRESS)
+    if address is None or len(address) != 4:
+        return None
+    return index, socket.inet_ntoa(address)
+
+
+class LocalAddresses(Thread):
+    # Local IPv4 addresses (without loopback), kept up to date from rtnetlink address events.
+    poll_interval = 5  # without netlink (not Linux) addresses are polled through the resolver
+
+    def __init__(self):
+        super(LocalAddresses, self).__init__(name='addresses')
+        self.daemon = True
+        self.condition = Condition()
+        self.addresses = frozenset()
+        self.ready = False
+        self.interface_addresses = set()  # (interface index, ip)
+        self.dump = None  # addresses of a dump in progress, published only when it is complete
+        self.changed = Observable()  # (addresses)
+
+    def set_addresses(self, addresses):
+        addresses = frozenset(ip for ip in addresses if not ip.startswith("127."))
+        with self.condition:
+            if addresses == self.addresses and self.ready:
+                return
+            self.addresses = addresses
+            self.ready = True
+            self.condition.notify_all()
+        self.changed.emit(addresses)
+
+    def get(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.ready, 5)
+            return self.addresses
+
+    def run(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_IPV4_IFADDR))
+        except (AttributeError, OSError):
+            self.poll()
+            return
+
+        request = nlmsghdr.pack(nlmsghdr.size + 8, RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.send(request + struct.pack('=B7x', socket.AF_INET))
+        self.dump = set()
+
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:  # ENOBUFS: events were lost, dump again, the current addresses stay until it is done
+                sock.send(request + struct.pack('=B7x', socket.AF_INET))
+                self.dump = set()
+                continue
+            self.handle(data)
+
+    def handle(self, data):
+        offset = 0
+        done = False
+        while offset + nlmsghdr.size <= len(data):
+            length, type, _, _, _ = nlmsghdr.unpack_from(data, offset)
+            if length < nlmsghdr.size:
+                break
+            message = data[offset + nlmsghdr.size:offset + length]
+            offset += align(length)
+            if type in (RTM_NEWADDR, RTM_DELADDR):
+                address = parse_address(message)
+                if address is None:
+                    continue
+                # events during a dump go into it as well, they may be newer than its messages
+                addresses = self.interface_addresses if self.dump is None else self.dump
+                if type == RTM_NEWADDR:
+                    addresses.add(address)
+                else:
+                    addresses.discard(address)
+            elif type in (NLMSG_DONE, NLMSG_ERROR) and self.dump is not None:
+                self.interface_addresses, self.dump = self.dump, None
+                done = True
+        if done or (self.ready and self.dump is None):
+            self.set_addresses(ip for _, ip in self.interface_addresses)
+
+    def poll(self):
+        while True:
+            try:
+                self.set_addresses(socket.gethostbyname_ex(socket.gethostname())[2])
+            except OSError:
+                pass
+            sleep(self.poll_interval)
+
+
+def get_local_addresses():
+    global service
+    with service_lock:
+        if service is None:
+            service = LocalAddresses()
+            service.start()
+        return service
@@ -0,0 +1,273 @@
+import json
+import os
+import shlex
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+from time import monotonic, time
+
+from host_monitor import events
+from host_monitor.command import Command
+from host_monitor.config import args
+from host_monitor.host import state_names
+from host_monitor.profiler import timer, record
+from host_monitor.scheduler import TokenBucket
+
+
+class Alert(object):
+    # hosts of one group that changed to the same state within one alert window
+    max_names = 5  # host names listed in the message
+
+    def __init__(self, group, state, names, timestamp):
+        self.group = group
+        self.state = state
+        self.names = names
+        self.time = timestamp
+
+    @property
+    def message(self):
+        if len(self.names) == 1:
+            return f"{self.names[0]} {self.state} in group {self.group}"
+        names = ', '.join(self.names[:self.max_names]) + (', ...' if len(self.names) > self.max_names else '')
+        return f"{len(self.names)} hosts {self.state} in group {self.group}: {names}"
+
+    def to_json(self):
+        return {'time': self.time, 'group': self.group, 'state': self.state, 'hosts': self.names,
+                'message': self.message}
+
+
+class Sink(object):
+    # Delivers batches of alerts, deliver() raises on failure. Options common to all sinks:
+    #   rate_limit: deliveries per minute, alerts in between are delivered together with the next one,
+    #   retries: of a failed delivery, after 1, 2, 4, ... seconds,
+    #   timeout: seconds of a command or request.
+    def __init__(self, options):
+        rate = options.get('rate_limit', 6) / 60
+        self.bucket = TokenBucket(rate, max(1, rate * 30))
+        self.retries = options.get('retries', 3)
+        self.timeout = options.get('timeout', 10)
+        self.pending = []  # alerts waiting for delivery
+        self.busy = False  # a delivery is running, one at a time per sink
+        self.attempt = 0
+        self.retry_time = 0
+        self.dropped = 0
+
+    def deliver(self, alerts):
+        raise NotImplementedError
+
+    def run(self, command):
+        command = Command(command, self.timeout)
+        command.run()  # on the calling worker
+        if not command.success:
+            raise OSError(str(command))
+
+
+class LogSink(Sink):
+    # type: log, path: file the alerts are appended to
+    def __init__(self, options):
+        super(LogSink, self).__init__(options)
+        self.path = options['path']
+
+    def deliver(self, alerts):
+        with open(os.path.expanduser(self.path), 'a') as file:
+            for alert in alerts:
+                file.write(f"{datetime.fromtimestamp(alert.time):%Y-%m-%d %H:%M:%S} {alert.message}\n")
+
+
+class ShellSink(Sink):
+    # type: shell, command: run with the alert messages, one per line, as its last argument
+    def __init__(self, options):
+        super(ShellSink, self).__init__(options)
+        self.command = options['command']
+
+    def deliver(self, alerts):
+        self.run(f"{self.command} {shlex.quote(chr(10).join(alert.message for alert in alerts))}")
+
+
+class DesktopSink(Sink):
+    # type: desktop, a notification through notify-send
+    def deliver(self, alerts):
+        self.run(f"notify-send host-monitor {shlex.quote(chr(10).join(alert.message for alert in alerts))}")
+
+
+class WebhookSink(Sink):
+    # type: webhook, url: POSTed {"alerts": [{"time", "group", "state", "hosts", "message"}, ...]}
+    def __init__(self, options):
+        super(WebhookSink, self).__init__(options)
+        self.url = options['url']
+
+    def deliver(self, alerts):
+        data = json.dumps({'alerts': [alert.to_json() for alert in alerts]}).encode()
+        request = urllib.request.Request(self.url, data, {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+sink_types = {
+    'log': LogSink,
+    'shell': ShellSink,
+    'desktop': DesktopSink,
+    'webhook': WebhookSink,
+}
+
+
+class AlertPipeline(Thread):
+    # Turns host and VPN state changes into alerts. Observers only put changes into a bounded queue (dropping
+    # them when it is full), so probe and GUI threads never wait. The changes of alert_window seconds are
+    # batched into one alert per group and state ("37 hosts down in group 2"); hosts back in their previous
+    # state by the end of the window, first statuses of hosts that are fine, VPNs in transition and hosts
+    # unreachable or back after their parent was down (see Dependencies) are left out.
+    # Alerts are delivered on a pool of alert_workers threads, each sink with its own rate limit and retries.
+    # Dropped changes and alerts are reported at most once per drop_report_interval seconds.
+    max_queue = 10000
+    max_pending = 100  # alerts kept per sink while it is rate limited or failing, the oldest are dropped
+    retry_delay = 1
+    drop_report_interval = 60
+    quiet_states = ('unknown', 'connecting', 'disconnecting', 'unreachable (parent down)')  # never alerted
+    fine_states = ('up', 'degraded', 'connected', 'disconnected')  # not alerted as the first status of a host
+    fresh_states = (None, 'unreachable (parent down)')  # ... or after its parent was down, the parent is alerted
+
+    def __init__(self, sinks, window, workers):
+        super(AlertPipeline, self).__init__(name='alerts')
+        self.daemon = True
+        self.sinks = sinks
+        self.window = window
+        self.queue = Queue(self.max_queue)
+        self.dropped = 0
+        self.reported = 0  # drops (changes and alerts) reported so far
+        self.lock = Lock()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='alert-sink')
+        self.states = {}  # host id -> last state seen
+        events.state_changed.subscribe(self.state_changed)
+
+    def state_changed(self, host, state):
+        # VPNs publish up/down, their state machine state is alerted instead
+        try:
+            self.queue.put_nowait((host.id, host.state if host.is_vpn else state_names.get(state, state)))
+        except Full:
+            self.dropped += 1
+
+    def wake(self):
+        try:
+            self.queue.put_nowait(None)
+        except Full:  # busy anyway
+            pass
+
+    def batch(self, changes):
+        # changes: host id -> [state before the window, latest state]
+        batches = {}
+        for host_id, (before, after) in changes.items():
+            if before == after or after in self.quiet_states or (before in self.fresh_states and
+                                                                 after in self.fine_states):
+                continue
+            batches.setdefault((host_id[0], after), []).append(host_id[1])
+        now = time()
+        alerts = [Alert(group, state, names, now) for (group, state), names in sorted(batches.items())]
+        if args.verbose:
+            for alert in alerts:
+                print(f"Alert: {alert.message}")
+        with self.lock:
+            for sink in self.sinks:
+                sink.pending.extend(alerts)
+                if len(sink.pending) > self.max_pending:
+                    sink.dropped += len(sink.pending) - self.max_pending
+                    del sink.pending[:-self.max_pending]
+
+    def deliver(self, sink, alerts):
+        try:
+            with timer('alerts.deliver'):
+                sink.deliver(alerts)
+            sink.attempt = 0
+        except Exception as e:
+            if sink.attempt < sink.retries:
+                sink.retry_time = monotonic() + self.retry_delay * 2 ** sink.attempt
+                sink.attempt += 1
+                with self.lock:
+                    sink.pending[:0] = alerts
+                    if len(sink.pending) > self.max_pending:
+                        sink.dropped += len(sink.pending) - self.max_pending
+                        del sink.pending[:-self.max_pending]
+            else:
+                print(f"Alert {sink.__class__.__name__} failed after {sink.attempt + 1} attempts: {e}",
+                      file=sys.stderr)
+                sink.attempt = 0
+        finally:
+            sink.busy = False
+            self.wake()
+
+    def dispatch(self, now):
+        # starts the deliveries that are due, returns the time of the next one (or None)
+        next_time = None
+        for sink in self.sinks:
+            with self.lock:
+                if sink.busy or not sink.pending:
+                    continue
+                if now >= sink.retry_time and sink.bucket.take(now):
+                    alerts, sink.pending = sink.pending, []
+                    sink.busy = True
+                    self.pool.submit(self.deliver, sink, alerts)
+                    continue
+            due = max(sink.retry_time, now + sink.bucket.wait_time(now))
+            next_time = due if next_time is None else min(next_time, due)
+        return next_time
+
+    def drops(self):
+        return self.dropped + sum(sink.dropped for sink in self.sinks)
+
+    def report_drops(self):
+        dropped = self.drops()
+        record('alerts.dropped.count', dropped - self.reported)
+        sinks = ', '.join(f"{sink.dropped} by {sink.__class__.__name__}" for sink in self.sinks if sink.dropped)
+        print(f"Alerts dropped so far: {self.dropped} state changes (queue full)" +
+              (f", alerts {sinks} (too many pending)" if sinks else ''), file=sys.stderr)
+        self.reported = dropped
+
+    def run(self):
+        changes = {}
+        window_end = None
+        next_dispatch = None
+        next_report = 0
+        while True:
+            now = monotonic()
+            report = next_report if self.drops() > self.reported else None
+            deadlines = [deadline for deadline in (window_end, next_dispatch, report) if deadline is not None]
+            try:
+                change = self.queue.get(timeout=max(min(deadlines) - now, 0) if deadlines else None)
+            except Empty:
+                change = None
+            if change:
+                host_id, state = change
+                if host_id in changes:
+                    changes[host_id][1] = state
+                else:
+                    changes[host_id] = [self.states.get(host_id), state]
+                    if window_end is None:
+                        window_end = monotonic() + self.window
+                self.states[host_id] = state
+            now = monotonic()
+            if window_end is not None and now >= window_end:
+                record('alerts.batch.depth', len(changes))
+                self.batch(changes)
+                changes = {}
+                window_end = None
+            next_dispatch = self.dispatch(now)
+            if now >= next_report and self.drops() > self.reported:
+                self.report_drops()
+                next_report = now + self.drop_report_interval
+
+
+def start_alerts(settings):
+    sinks = []
+    for options in settings['alerts']:
+        try:
+            sinks.append(sink_types[options['type']](options))
+        except (KeyError, TypeError) as e:
+            print(f"Invalid alert sink {options}: missing or unknown {e}", file=sys.stderr)
+    if not sinks:
+        return None
+    pipeline = AlertPipeline(sinks, settings['alert_window'], settings['alert_workers'])
+    pipeline.start()
+    return pipeline
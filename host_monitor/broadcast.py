@@ -0,0 +1,229 @@
+import json
+import os
+import selectors
+import socket
+import sys
+from threading import Thread, Lock
+from time import monotonic
+
+from host_monitor import events
+from host_monitor.config import args
+from host_monitor.host import VPN
+
+
+def host_entry(host):
+    # [name, kind, address, resolved address, state, VPN mode]; states are true (up), false (down), null (unknown),
+    # "error", "degraded", "unreachable" (parent down) or the VPN states "connected", "connecting", "disconnected",
+    # "disconnecting"
+    if isinstance(host, VPN):
+        return [host.id[1], 'vpn', None, None, host.state, host.mode]
+    return [host.id[1], 'host', host.address, host.resolved_address, host.state, None]
+
+
+class Subscriber(object):
+    def __init__(self, sock):
+        self.socket = sock
+        self.input = b''
+        self.output = b''  # the message being written
+        self.snapshot = True  # a snapshot is due: new subscriber or config reloaded
+        self.changed = {}  # host id -> host changed since the last message, coalesced
+
+
+class StateServer(Thread):
+    # Serves host and VPN states on a Unix socket as JSON lines. A new subscriber gets a snapshot
+    #   {"type": "snapshot", "seq": N, "groups": [[host entry, ...], ...]}
+    # (again after config reloads), then deltas with the hosts changed since its previous message
+    #   {"type": "delta", "seq": N, "hosts": [[group, host entry], ...]}
+    # where seq counts changes, so deltas skip the changes that were coalesced. Subscribers may send
+    #   {"type": "mode", "group": G, "name": "VPN name", "mode": "auto"}
+    # Probe threads only record changes per subscriber; a delta is encoded when the previous message of that
+    # subscriber was written, at most every delta_interval seconds, so a slow subscriber gets fewer, bigger
+    # deltas and never stalls probing or the others, and its backlog is bounded by the number of hosts.
+    delta_interval = 0.05
+    max_input = 65536  # subscribers sending longer lines are disconnected
+
+    def __init__(self, monitor, path):
+        super(StateServer, self).__init__(name='state-server')
+        self.daemon = True
+        self.monitor = monitor
+        self.path = os.path.expanduser(path)
+        self.lock = Lock()
+        self.seq = 0
+        self.subscribers = {}  # socket -> Subscriber
+        self.notified = False
+        self.selector = selectors.DefaultSelector()
+        self.listener = self.listen()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        events.state_changed.subscribe(lambda host, state: self.changed(host))
+        events.host_changed.subscribe(self.changed)
+        events.hosts_changed.subscribe(self.hosts_changed)
+
+    def listen(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise OSError(f"{self.path} is served by another process")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)  # left over by a process that exited
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(16)
+        listener.setblocking(False)
+        return listener
+
+    def notify(self):
+        # called with the lock held
+        if not self.notified:
+            self.notified = True
+            try:
+                self.wakeup_send.send(b'\0')
+            except BlockingIOError:
+                pass
+
+    def changed(self, host):
+        if not host.id:
+            return
+        with self.lock:
+            self.seq += 1
+            for subscriber in self.subscribers.values():
+                subscriber.changed[host.id] = host
+            self.notify()
+
+    def hosts_changed(self, monitor):
+        with self.lock:
+            self.seq += 1
+            for subscriber in self.subscribers.values():
+                subscriber.snapshot = True
+                subscriber.changed = {}
+            self.notify()
+
+    def accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ)
+        with self.lock:
+            self.subscribers[sock] = Subscriber(sock)
+            self.notify()
+
+    def disconnect(self, subscriber):
+        with self.lock:
+            self.subscribers.pop(subscriber.socket, None)
+        self.selector.unregister(subscriber.socket)
+        subscriber.socket.close()
+
+    def receive(self, subscriber):
+        try:
+            data = subscriber.socket.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            return self.disconnect(subscriber)
+        *lines, subscriber.input = (subscriber.input + data).split(b'\n')
+        if len(subscriber.input) > self.max_input:
+            return self.disconnect(subscriber)
+        for line in lines:
+            try:
+                self.command(json.loads(line))
+            except (ValueError, TypeError, KeyError) as e:
+                if args.verbose:
+                    print(f"Invalid state socket command {line!r}: {e}", file=sys.stderr)
+
+    def command(self, message):
+        if message['type'] == 'mode':
+            host = self.monitor.hosts.get((message['group'], message['name']))
+            if isinstance(host, VPN) and message['mode'] in ('auto', 'connect', 'disconnect', 'ignore'):
+                host.mode = message['mode']
+                self.changed(host)
+
+    def encode(self, subscriber):
+        # the next message of subscriber, None if it is up to date
+        with self.lock:
+            snapshot, subscriber.snapshot = subscriber.snapshot, False
+            changed, subscriber.changed = subscriber.changed, {}
+            seq = self.seq
+        if snapshot:
+            hosts = self.monitor.hosts
+            message = {'type': 'snapshot', 'seq': seq,
+                       'groups': [[host_entry(hosts[host_id]) for host_id in group if host_id in hosts]
+                                  for group in self.monitor.groups]}  # a reload in between sends another one
+        elif changed:
+            message = {'type': 'delta', 'seq': seq,
+                       'hosts': [[host_id[0], host_entry(host)] for host_id, host in changed.items()]}
+        else:
+            return None
+        return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+    def send(self, subscriber):
+        try:
+            sent = subscriber.socket.send(subscriber.output)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            return self.disconnect(subscriber)
+        subscriber.output = subscriber.output[sent:]
+        self.selector.modify(subscriber.socket, selectors.EVENT_READ |
+                             (selectors.EVENT_WRITE if subscriber.output else 0))
+
+    def flush(self):
+        # encodes the next message of every subscriber that has written the previous one
+        with self.lock:
+            self.notified = False
+            subscribers = list(self.subscribers.values())
+        for subscriber in subscribers:
+            if not subscriber.output:
+                subscriber.output = self.encode(subscriber) or b''
+                if subscriber.output:
+                    self.send(subscriber)
+
+    def run(self):
+        next_flush = 0
+        while True:
+            with self.lock:
+                pending = self.notified
+            timeout = max(next_flush - monotonic(), 0) if pending else None
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.listener:
+                    self.accept()
+                elif key.fileobj is self.wakeup_recv:
+                    try:
+                        self.wakeup_recv.recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    subscriber = self.subscribers.get(key.fileobj)
+                    if subscriber and mask & selectors.EVENT_READ:
+                        self.receive(subscriber)
+                    if subscriber and mask & selectors.EVENT_WRITE and subscriber.socket in self.subscribers:
+                        self.send(subscriber)
+                        with self.lock:
+                            if not subscriber.output and (subscriber.snapshot or subscriber.changed):
+                                self.notified = True  # changes collected while it was written
+            now = monotonic()
+            with self.lock:
+                pending = self.notified
+            if pending and now >= next_flush:
+                self.flush()
+                next_flush = now + self.delta_interval
+
+
+def start_state_server(monitor, path):
+    try:
+        server = StateServer(monitor, path)
+    except OSError as e:
+        print(f"Cannot serve states on {path}: {e}", file=sys.stderr)
+        return None
+    server.start()
+    return server
@@ -0,0 +1,283 @@
+import asyncio
+import random
+import socket
+import ssl
+import struct
+from threading import Thread, Lock
+from time import monotonic
+from urllib.parse import urlsplit
+
+from host_monitor.config import config
+from host_monitor.profiler import timer
+from host_monitor.resolver import get_resolver, is_ip_address, build_query, parse_response
+from host_monitor.scheduler import Scheduler
+
+default_ports = {'http': 80, 'https': 443, 'dns': 53}
+
+checker_lock = Lock()
+checker = None
+
+
+def is_check(address):
+    # probe addresses of tcp/http/dns checks are URLs, pings have plain addresses
+    return address.partition('://')[0] in ('tcp', 'http', 'https', 'dns')
+
+
+class CheckTarget(object):
+    # Parsed check address, options are given after '#':
+    #   tcp://host:port, http(s)://host[:port]/path, dns://server[:port]/name, e.g. tcp://example.com:22#timeout=5
+    options = ('timeout',)
+
+    def __init__(self, address):
+        url, _, options = address.partition('#')
+        parts = urlsplit(url)
+        self.kind = 'http' if parts.scheme == 'https' else parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or default_ports.get(parts.scheme)
+        self.tls = parts.scheme == 'https'
+        self.ip = None
+        self.timeout = config['settings']['check_timeout']
+        if not self.host or not self.port:
+            raise ValueError(f"missing host or port: {url}")
+        if self.kind == 'dns':
+            self.name = parts.path.strip('/')
+            if not self.name:
+                raise ValueError(f"missing name to query: {url}")
+        elif self.kind == 'http':
+            host = self.host if parts.port is None else f"{self.host}:{parts.port}"
+            path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+            self.request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: host-monitor\r\n"
+                            f"Connection: keep-alive\r\n\r\n").encode()
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            if key not in self.options:
+                raise ValueError(f"unknown check option: {key}")
+            setattr(self, key, float(value))
+
+
+class DnsProtocol(asyncio.DatagramProtocol):
+    # one UDP socket for all dns checks, answers are matched to queries by id and server
+    def __init__(self):
+        self.transport = None
+        self.pending = {}  # (query id, server address) -> future of the response code
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        try:
+            query_id, rcode, _, _ = parse_response(data)
+        except (struct.error, IndexError):
+            return
+        future = self.pending.get((query_id, address[:2]))
+        if future and not future.done():
+            future.set_result(rcode)
+
+
+async def read_response(reader):
+    # reads an HTTP response, returns (status, whether the connection can be reused)
+    status_line = await reader.readline()
+    if not status_line:
+        raise EOFError("connection closed")
+    version, status = status_line.split(None, 2)[:2]
+    status = int(status)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    keep_alive = version == b'HTTP/1.1' and headers.get('connection') != 'close'
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):  # trailers
+                    pass
+                break
+            await reader.readexactly(size + 2)
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif not (100 <= status < 200 or status in (204, 304)):
+        await reader.read()  # until the server closes the connection
+        keep_alive = False
+    return status, keep_alive
+
+
+class CheckEngine(Thread):
+    # Runs tcp, http and dns checks of all probes as tasks of one asyncio event loop, so thousands of them
+    # take no thread each. Checks are timed by the same Scheduler as pings and fail after their timeout:
+    #  * tcp: time to connect to the port, the connection is closed at once,
+    #  * http: time of a GET until the whole response, over one kept-alive connection per target; up below 400,
+    #  * dns: time until the server answers an A query of the name with NOERROR, over one shared UDP socket.
+    # Hostnames are resolved in the background by the shared Resolver. Unresolvable targets and refused
+    # connections (nothing to check listens on the port) are probe errors.
+    def __init__(self):
+        super(CheckEngine, self).__init__(name='checks')
+        self.daemon = True
+        self.loop = asyncio.new_event_loop()
+        self.scheduler = Scheduler()
+        self.targets = {}  # probe -> CheckTarget
+        self.watches = {}  # probe -> (hostname, resolver callback)
+        self.running = set()  # probes with a check in flight, never checked twice at once
+        self.tasks = set()
+        self.connections = {}  # probe -> (reader, writer) of its kept-alive http connection
+        self.ssl_context = ssl.create_default_context()
+        self.dns_protocol = None
+        self.wakeup = None
+        self.sent = 0
+
+    def add(self, probe):
+        try:
+            target = CheckTarget(probe.address)
+        except ValueError as e:
+            probe.probe_error(e)
+            return
+        if is_ip_address(target.host):
+            self.add_target(probe, target, target.host)
+        else:
+            callback = lambda name, ips, error: self.resolved(probe, target, ips, error)
+            self.watches[probe] = (target.host, callback)
+            get_resolver().watch(target.host, callback)
+
+    def remove(self, probe):
+        self.scheduler.remove(probe)
+        self.targets.pop(probe, None)
+        watch = self.watches.pop(probe, None)
+        if watch:
+            get_resolver().unwatch(*watch)
+        connection = self.connections.pop(probe, None)
+        if connection:
+            self.loop.call_soon_threadsafe(connection[1].close)
+
+    def resolved(self, probe, target, ips, error):
+        if probe.stopped:
+            return
+        if error:
+            if probe not in self.targets:  # otherwise keep checking the last known address
+                probe.probe_error(error)
+            return
+        if target.ip in ips:
+            return
+        if probe in self.targets:
+            target.ip = ips[0]
+            probe.resolved_address = ips[0]
+            probe.address_changed.emit(probe)
+        else:
+            self.add_target(probe, target, ips[0])
+
+    def add_target(self, probe, target, ip):
+        target.ip = ip
+        self.targets[probe] = target
+        probe.resolved_address = ip
+        probe.address_changed.emit(probe)
+        self.scheduler.add(probe, monotonic())
+        self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        if self.wakeup:
+            self.wakeup.set()
+
+    def update(self, probe, success, rtt=None):
+        if probe.update(success, rtt):
+            self.scheduler.changed(probe)
+
+    async def check(self, probe, target):
+        start = monotonic()
+        error = None
+        try:
+            success = await asyncio.wait_for(getattr(self, target.kind)(probe, target), target.timeout)
+        except ConnectionRefusedError as e:
+            success, error = False, e
+        except (OSError, EOFError, ValueError, asyncio.TimeoutError):  # reset, timed out, bad response
+            success = False
+        finally:
+            self.running.discard(probe)
+        if probe in self.targets:
+            with timer('checks.result'):
+                if error:
+                    if probe.probe_error(error):
+                        self.scheduler.changed(probe)
+                else:
+                    self.update(probe, success, (monotonic() - start) * 1000 if success else None)
+
+    async def tcp(self, probe, target):
+        _, writer = await asyncio.open_connection(target.ip, target.port)
+        writer.close()
+        return True
+
+    async def http(self, probe, target):
+        connection = self.connections.pop(probe, None)
+        reused = connection is not None
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(
+                    target.ip, target.port, **({'ssl': self.ssl_context, 'server_hostname': target.host}
+                                               if target.tls else {}))
+            reader, writer = connection
+            writer.write(target.request)
+            status, keep_alive = await read_response(reader)
+        except (OSError, EOFError, ValueError):
+            if connection:
+                connection[1].close()
+            if reused:  # closed by the server while idle, retried on a new connection
+                return await self.http(probe, target)
+            raise
+        except asyncio.CancelledError:  # timed out
+            connection and connection[1].close()
+            raise
+        if keep_alive and probe in self.targets:
+            self.connections[probe] = connection
+        else:
+            writer.close()
+        return status < 400
+
+    async def dns(self, probe, target):
+        query_id = random.getrandbits(16)
+        while (query_id, (target.ip, target.port)) in self.dns_protocol.pending:
+            query_id = random.getrandbits(16)
+        key = (query_id, (target.ip, target.port))
+        future = self.dns_protocol.pending[key] = self.loop.create_future()
+        try:
+            self.dns_protocol.transport.sendto(build_query(query_id, target.name), key[1])
+            return await future == 0
+        finally:
+            del self.dns_protocol.pending[key]
+
+    async def main(self):
+        self.wakeup = asyncio.Event()
+        _, self.dns_protocol = await self.loop.create_datagram_endpoint(DnsProtocol, family=socket.AF_INET)
+        while True:
+            now = monotonic()
+            with timer('scheduler.due'):
+                due = self.scheduler.due(now)
+            for probe in due:
+                target = self.targets.get(probe)
+                if target is None or probe in self.running:
+                    continue
+                self.sent += 1
+                self.running.add(probe)
+                task = self.loop.create_task(self.check(probe, target))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            deadline = self.scheduler.next_deadline(monotonic()) or now + self.scheduler.max_interval
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(deadline - monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.main())
+
+
+def get_checker():
+    # shared engine of all tcp/http/dns checks, always in the main process
+    global checker
+    with checker_lock:
+        if checker is None:
+            checker = CheckEngine()
+            checker.start()
+        return checker
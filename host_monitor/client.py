@@ -0,0 +1,146 @@
+import json
+import os
+import socket
+import sys
+from threading import Thread, Lock
+from time import sleep
+
+from host_monitor import events
+
+
+class RemoteHost(object):
+    # A host of the daemon the GUI is attached to; its statistics and history stay in the daemon
+    is_vpn = False
+    rtt = None
+    loss = None
+    history = None
+    parent = None
+    probe_errors = 0
+    probe_restarts = 0
+
+    def __init__(self, monitor, id, entry):
+        self.monitor = monitor
+        self.id = id
+        self.update(entry)
+
+    def update(self, entry):
+        _, _, self.address, self.resolved_address, self.state, self._mode = entry
+
+
+class RemoteVPN(RemoteHost):
+    is_vpn = True
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        self._mode = mode
+        self.monitor.send({'type': 'mode', 'group': self.id[0], 'name': self.id[1], 'mode': mode})
+
+
+class RemoteMonitor(Thread):
+    # Stands in for Monitor in a GUI attached to a running daemon (--attach): hosts and their states come from
+    # the state socket of the daemon (see StateServer) and VPN modes set in the GUI are sent to it, nothing is
+    # probed locally. The first snapshot is awaited for up to connect_timeout seconds so that the GUI starts
+    # with all hosts; when the daemon exits, all states turn unknown until it is back.
+    connect_timeout = 2
+    retry_interval = 1
+
+    def __init__(self, path):
+        super(RemoteMonitor, self).__init__(name='state-client')
+        self.daemon = True
+        self.path = os.path.expanduser(path)
+        self.hosts = {}
+        self.groups = []
+        self.seq = None
+        self.socket = None
+        self.send_lock = Lock()
+        self.lines = None
+        try:
+            self.connect()
+            self.socket.settimeout(self.connect_timeout)
+            self.receive(next(self.lines))
+        except (OSError, StopIteration, ValueError) as e:
+            print(f"Cannot attach to {self.path}: {e}, retrying", file=sys.stderr)
+            self.close()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.socket = sock
+        self.lines = iter(sock.makefile('rb'))
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+        self.socket = self.lines = None
+
+    def send(self, message):
+        with self.send_lock:
+            try:
+                self.socket.sendall(json.dumps(message).encode() + b'\n')
+            except (OSError, AttributeError):  # disconnected, the snapshot after reconnecting shows the daemon's mode
+                pass
+
+    def receive(self, line):
+        message = json.loads(line)
+        if message['type'] == 'snapshot':
+            hosts = {}
+            groups = []
+            for group_id, entries in enumerate(message['groups']):
+                groups.append([])
+                for entry in entries:
+                    host_id = (group_id, entry[0])
+                    hosts[host_id] = (RemoteVPN if entry[1] == 'vpn' else RemoteHost)(self, host_id, entry)
+                    groups[-1].append(host_id)
+            self.hosts, self.groups = hosts, groups
+            events.hosts_changed.emit(self)
+        elif message['type'] == 'delta':
+            for group_id, entry in message['hosts']:
+                host = self.hosts.get((group_id, entry[0]))
+                if host is None:
+                    continue
+                state = host.state
+                host.update(entry)
+                if host.state != state:
+                    events.state_changed.emit(host, host.state)
+                else:
+                    events.host_changed.emit(host)
+        self.seq = message['seq']
+
+    def disconnected(self):
+        self.close()
+        for host in self.hosts.values():
+            if host.state is not None:
+                host.state = None
+                events.state_changed.emit(host, None)
+
+    def run(self):
+        while True:
+            if self.socket is None:
+                try:
+                    self.connect()
+                except OSError:
+                    sleep(self.retry_interval)
+                    continue
+            self.socket.settimeout(None)
+            try:
+                for line in self.lines:
+                    self.receive(line)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"State socket {self.path}: {e}", file=sys.stderr)
+            self.disconnected()
+
+    def get_host(self, group=None, name=None, ip=None):
+        if group is not None and name and (group, name) in self.hosts:
+            return self.hosts[(group, name)]
+        for host in self.hosts.values():
+            if (name and host.id[1] == name) or (ip and host.address == ip):
+                return host
+        return None
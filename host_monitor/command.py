@@ -0,0 +1,86 @@
+import os
+import shlex
+import signal
+import subprocess as sp
+import sys
+import tempfile
+from threading import Thread
+from time import monotonic
+
+
+class Command(Thread):
+    # Runs a shell-like command line in the background with a timeout, capturing its output and exit code.
+    # Output goes to a temporary file and the command's own exit is awaited, not the end of its output, so
+    # that background processes it leaves (e.g. a VPN daemon) holding the output open do not block it; on
+    # timeout its whole process group is killed.
+    max_output = 4096  # characters of output kept
+
+    def __init__(self, command, timeout=None, on_done=None):
+        super(Command, self).__init__(name='command')
+        self.daemon = True
+        self.command = command
+        self.timeout = timeout or None
+        self.on_done = on_done
+        self.start_time = None
+        self.duration = None
+        self.returncode = None
+        self.output = ''
+        self.timed_out = False
+        self.error = None
+
+    @property
+    def running(self):
+        return self.start_time is not None and self.duration is None
+
+    @property
+    def success(self):
+        return self.returncode == 0
+
+    def run(self):
+        self.start_time = monotonic()
+        try:
+            if sys.platform == 'win32':
+                startupinfo = sp.STARTUPINFO()
+                startupinfo.dwFlags |= sp.STARTF_USESHOWWINDOW
+                creationflags = sp.CREATE_NO_WINDOW
+            else:
+                startupinfo = None
+                creationflags = 0
+
+            with tempfile.TemporaryFile() as output:
+                process = sp.Popen(shlex.split(self.command), stdin=sp.DEVNULL, stdout=output, stderr=sp.STDOUT,
+                                   shell=False, creationflags=creationflags, startupinfo=startupinfo,
+                                   start_new_session=sys.platform != 'win32')
+                try:
+                    process.wait(timeout=self.timeout)
+                except sp.TimeoutExpired:
+                    self.timed_out = True
+                    self.kill(process)
+                    process.wait()
+                output.seek(max(output.tell() - self.max_output * 4, 0))  # up to 4 bytes per character
+                self.output = output.read().decode('utf8', errors='replace')[-self.max_output:]
+            self.returncode = process.returncode
+        except Exception as e:
+            self.error = e
+        self.duration = monotonic() - self.start_time
+        if self.on_done:
+            self.on_done(self)
+
+    @staticmethod
+    def kill(process):
+        if sys.platform == 'win32':
+            process.kill()
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def __str__(self):
+        if self.error:
+            result = f"failed: {self.error}"
+        elif self.timed_out:
+            result = f"timed out after {self.duration:.1f}s"
+        else:
+            result = f"exit code {self.returncode} after {self.duration:.1f}s"
+        return f"'{self.command}' {result}"
@@ -1,22 +1,140 @@
+import json
 import os
 import shutil
 from argparse import ArgumentParser
 
 import yaml
 
+config_path = os.path.expanduser("~/.host-monitor")
+default_path = os.path.normpath(f"{__file__}/../config_default.yaml")
+cache_path = os.path.expanduser("~/.cache/host-monitor/config.json")
+
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)  # libyaml is much faster, when available
+
+required_keys = {
+    'internet-monitor': ['address'],
+    'host': ['name', 'address'],
+    'tcp': ['name', 'address'],
+    'http': ['name', 'address'],
+    'dns': ['name', 'address', 'query'],
+    'vpn': ['name', 'mode', 'assigned_ip', 'ping_ip', 'exclude_ips', 'connect', 'disconnect'],
+}
+
 
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument('-v', '--verbose', help='Show debug messages', action="store_true")
+    parser.add_argument('--headless', help='Run without GUI, print state changes to stdout', action="store_true")
+    parser.add_argument('--profile', help='Print timings of hot paths and CPU usage of threads to stderr',
+                        action="store_true")
+    parser.add_argument('--profile-interval', help='Seconds between profile summaries (default 10)', type=float,
+                        default=10)
+    parser.add_argument('--profile-output', help='With --profile, also write sampled stacks of all threads '
+                                                 'to this file in folded (flamegraph) format', metavar='FILE')
+    parser.add_argument('--attach', help='Show the states of a running host-monitor serving them on SOCKET '
+                                         '(default: state_socket of the settings) instead of probing',
+                        nargs='?', const='', metavar='SOCKET')
+    parser.add_argument('--startup-timing', help='Print the time of each startup phase to stderr, '
+                                                 'until every host has its first status', action="store_true")
     return parser.parse_args()
 
 
+def validate_config(config):
+    if not isinstance(config, dict):
+        raise ValueError("config must be a mapping")
+    if not isinstance(config.get('groups'), list):
+        raise ValueError("'groups' must be a list")
+    for group_id, host_group in enumerate(config['groups']):
+        if not isinstance(host_group, dict) or not isinstance(host_group.get('hosts'), list):
+            raise ValueError(f"group {group_id}: 'hosts' must be a list")
+        for definition in host_group['hosts']:
+            if not isinstance(definition, dict):
+                raise ValueError(f"group {group_id}: host definitions must be mappings")
+            type = definition.get('type')
+            if type not in required_keys:
+                raise ValueError(f"group {group_id}: unknown host type: {type}")
+            missing = [key for key in required_keys[type] if key not in definition]
+            if missing:
+                raise ValueError(f"group {group_id}: {type} is missing {', '.join(missing)}")
+    validate_dependencies(config)
+
+
+def validate_dependencies(config):
+    # depends_on names another host, INTERNET (the internet monitor) or a VPN, without cycles
+    parents = {}
+    names = set()
+    vpns = []  # VPNs depending on INTERNET by default
+    for host_group in config['groups']:
+        for definition in host_group['hosts']:
+            name = 'INTERNET' if definition['type'] == 'internet-monitor' else definition['name']
+            names.add(name)
+            if definition.get('depends_on') is not None:
+                parents[name] = definition['depends_on']
+            elif definition['type'] == 'vpn' and 'depends_on' not in definition:
+                vpns.append(name)
+    if 'INTERNET' in names:
+        parents.update((name, 'INTERNET') for name in vpns)
+    for name, parent in parents.items():
+        if parent not in names:
+            raise ValueError(f"{name} depends on unknown host: {parent}")
+        seen = {name}
+        ancestor = parent
+        while ancestor in parents and ancestor not in seen:
+            seen.add(ancestor)
+            ancestor = parents[ancestor]
+        if ancestor == name:
+            raise ValueError(f"{name} depends on itself through {parent}")
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+def read_cache(key):
+    try:
+        with open(cache_path) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return cache['config'] if cache.get('key') == key else None
+
+
+def write_cache(key, config):
+    # only configs that survive JSON unchanged are cached (not e.g. YAML dates or numeric keys)
+    try:
+        data = json.dumps({'key': key, 'config': config})
+        if json.loads(data)['config'] != config:
+            return
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + '.tmp', 'w') as file:
+            file.write(data)
+        os.replace(cache_path + '.tmp', cache_path)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def load_config(path=config_path):
+    # the parsed config is cached as JSON, which loads much faster than YAML, until either file changes
+    key = [file_key(path), file_key(default_path)]
+    config = read_cache(key)
+    if config is not None:
+        return config
+    with open(path) as file:
+        config = yaml.load(file, Loader=Loader)
+    validate_config(config)
+    # settings added in newer versions may be missing in older config files
+    with open(default_path) as file:
+        defaults = yaml.load(file, Loader=Loader)
+    config['settings'] = {**defaults['settings'], **(config.get('settings') or {})}
+    write_cache(key, config)
+    return config
+
+
 def read_config():
-    config_path = os.path.expanduser("~/.host-monitor")
     if not os.path.exists(config_path):
-        default_path = os.path.normpath(f"{__file__}/../config_default.yaml")
         shutil.copy(default_path, config_path)
-    return yaml.safe_load(open(config_path))
+    return load_config()
 
 
 args = parse_args()
@@ -0,0 +1,33 @@
+import signal
+from datetime import datetime
+from threading import Event
+
+from host_monitor import events, startup
+from host_monitor.host import state_names
+from host_monitor.monitor import Monitor
+
+
+def print_state(host, up):
+    # VPNs publish up/down (None while connecting or disconnecting), their state machine state is printed instead
+    name = "{}/{}".format(*host.id)
+    state = host.state if host.is_vpn else state_names.get(up, up)
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {name} {state}", flush=True)
+
+
+def run_daemon():
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    events.state_changed.subscribe(print_state)
+    monitor = Monitor()
+    startup.phase('monitor')
+    startup.watch(monitor)
+    monitor.start()
+    startup.phase('probes started')
+
+    try:
+        while not stop.wait(3600):
+            pass
+    except KeyboardInterrupt:
+        pass
+    return 0
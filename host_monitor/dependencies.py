@@ -0,0 +1,72 @@
+from threading import RLock
+
+from host_monitor import events
+from host_monitor.host import UNREACHABLE
+
+
+def is_down(host):
+    # parents are down when they are down or unreachable themselves, VPNs unless connected
+    if host.is_vpn:
+        return host.state is not None and host.state != 'connected'
+    return host.state is False or host.state == UNREACHABLE
+
+
+class Dependencies(object):
+    # Hosts may depend on another host, the internet monitor (INTERNET) or a VPN (depends_on). While it is
+    # down, probing them is pointless: their probes are suspended and they are unreachable, so an outage of an
+    # uplink is one state change per host instead of packets, flapping and state changes until it is back.
+    # When the parent is up again, all its children are probed at once. A probe shared with hosts whose
+    # parents are up, or with a VPN pinger, keeps probing.
+    def __init__(self):
+        self.lock = RLock()  # suspending a child changes its state, which may suspend its own children
+        self.children = {}  # parent host id -> child hosts
+        self.blocked = {}  # probe -> hosts of it whose parent is down
+        events.state_changed.subscribe(self.state_changed)
+
+    def link(self, monitor):
+        # (re)links children and parents after the config changed
+        children = {}
+        for host_id, host in monitor.hosts.items():
+            if host.is_vpn:  # VPNs look up their parent themselves
+                continue
+            name = monitor.definitions[host_id].get('depends_on')
+            parent = monitor.get_host(host_id[0], name) if name else None
+            host.parent = parent if parent is not host else None
+            if host.parent:
+                children.setdefault(host.parent.id, []).append(host)
+        with self.lock:
+            self.children = children
+            probes = set(self.blocked)
+            self.blocked = {}
+            for parent_id, hosts in children.items():
+                if is_down(hosts[0].parent):
+                    for host in hosts:
+                        self.blocked.setdefault(host.probe, set()).add(host)
+            for probe in probes | set(self.blocked):
+                self.update(probe)
+
+    def state_changed(self, host, state):
+        if host.id not in self.children:
+            return
+        down = is_down(host)
+        with self.lock:
+            for child in self.children.get(host.id, ()):
+                if child.parent is not host:  # relinked meanwhile
+                    continue
+                hosts = self.blocked.setdefault(child.probe, set())
+                if down:
+                    hosts.add(child)
+                else:
+                    hosts.discard(child)
+                self.update(child.probe)
+
+    def update(self, probe):
+        # called with the lock held
+        hosts = self.blocked.get(probe)
+        suspend = bool(hosts) and len(hosts) >= probe.users and not probe.stopped
+        if not hosts:
+            self.blocked.pop(probe, None)
+        if suspend and not probe.suspended:
+            probe.suspend()
+        elif not suspend and probe.suspended and not probe.stopped:
+            probe.resume()
@@ -0,0 +1,25 @@
+from threading import Lock
+
+
+class Observable(object):
+    # plain observer list; observers are called on the publishing thread and must not block
+    def __init__(self):
+        self.lock = Lock()
+        self.observers = ()
+
+    def subscribe(self, observer):
+        with self.lock:
+            self.observers += (observer,)
+
+    def unsubscribe(self, observer):
+        with self.lock:
+            self.observers = tuple(o for o in self.observers if o != observer)
+
+    def emit(self, *args):
+        for observer in self.observers:
+            observer(*args)
+
+
+state_changed = Observable()  # (host or VPN, new state)
+host_changed = Observable()  # (host) other displayed attributes changed, e.g. resolved address
+hosts_changed = Observable()  # (monitor) hosts were added, removed or regrouped by a config reload
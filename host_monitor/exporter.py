@@ -0,0 +1,158 @@
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from time import monotonic
+
+from host_monitor.config import args
+from host_monitor.host import VPN, PROBE_ERROR, DEGRADED, UNREACHABLE
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+host_states = {
+    None: 'unknown',
+    False: 'down',
+    True: 'up',
+    PROBE_ERROR: 'error',
+    DEGRADED: 'degraded',
+    UNREACHABLE: 'unreachable',
+}
+
+vpn_states = ('connected', 'connecting', 'disconnected', 'disconnecting')
+
+# metric families: name, type, help
+families = (
+    ('host_monitor_up', 'gauge', 'Host answers pings (1) or not (0)'),
+    ('host_monitor_state', 'stateset', 'Host state'),
+    ('host_monitor_rtt_seconds', 'summary', 'Round-trip time of replies, quantiles over the last rtt_samples pings'),
+    ('host_monitor_loss_ratio', 'gauge', 'Lost pings over the last rtt_samples pings'),
+    ('host_monitor_jitter_seconds', 'gauge', 'Mean difference of consecutive round-trip times'),
+    ('host_monitor_pings', 'counter', 'Pings sent'),
+    ('host_monitor_state_changes', 'counter', 'Host state changes'),
+    ('host_monitor_probe_errors', 'counter', 'Failed probes (unresolvable address, send errors, ping exits)'),
+    ('host_monitor_vpn_state', 'stateset', 'VPN state'),
+    ('host_monitor_vpn_commands', 'counter', 'Finished VPN connect/disconnect commands by result'),
+    ('host_monitor_vpn_last_command_exit_code', 'gauge', 'Exit code of the last VPN command'),
+    ('host_monitor_vpn_last_command_duration_seconds', 'gauge', 'Run time of the last VPN command'),
+)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    return 'NaN' if value != value else repr(float(value))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.exporter.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args_):
+        if args.verbose:
+            super(MetricsHandler, self).log_message(format, *args_)
+
+
+class MetricsExporter(Thread):
+    # Serves /metrics in OpenMetrics text format. Samples of each host are rendered into per-family
+    # fragments that are cached and rebuilt only when the host changed, statistics at most every
+    # stats_max_age seconds; a scrape joins the fragments and only reads probe attributes, never locking them.
+    stats_max_age = 5
+
+    def __init__(self, monitor, listen):
+        super(MetricsExporter, self).__init__(name='metrics')
+        self.daemon = True
+        self.monitor = monitor
+        address, _, port = listen.rpartition(':')
+        self.server = ThreadingHTTPServer((address or '127.0.0.1', int(port)), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.exporter = self
+        self.lock = Lock()
+        self.cache = {}  # host id -> (key, rtt sample count, render time, fragments)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def render(self):
+        now = monotonic()
+        hosts = self.monitor.hosts
+        with self.lock:
+            cache = {}
+            for host_id, host in hosts.items():
+                cache[host_id] = self.render_host(host, self.cache.get(host_id), now)
+            self.cache = cache
+        lines = []
+        for index, (name, type, help) in enumerate(families):
+            lines.append(f"# TYPE {name} {type}\n# HELP {name} {help}\n")
+            lines.extend(entry[3][index] for entry in cache.values())
+        lines.append("# EOF\n")
+        return ''.join(lines).encode()
+
+    def render_host(self, host, entry, now):
+        if isinstance(host, VPN):
+            key = (host.state, host.command, host.command and host.command.duration)
+            count = 0
+        else:
+            key = (host.state, host.resolved_address, host.probe_errors)
+            count = host.rtt.count
+        if entry and entry[0] == key and (entry[1] == count or now - entry[2] < self.stats_max_age):
+            return entry
+        labels = f'group="{host.id[0]}",name="{escape(host.id[1])}"'
+        if isinstance(host, VPN):
+            fragments = self.vpn_fragments(host, labels)
+        else:
+            fragments = self.host_fragments(host, labels + f',address="{escape(host.address)}"')
+        return key, count, now, fragments
+
+    @staticmethod
+    def host_fragments(host, labels):
+        stats = host.rtt.stats()
+        rtt = host.rtt
+        state = ''.join(f'host_monitor_state{{{labels},host_monitor_state="{name}"}} {int(host.state == value)}\n'
+                        for value, name in host_states.items())
+        quantiles = ''.join(f'host_monitor_rtt_seconds{{{labels},quantile="{q}"}} {number(stats[p] / 1000)}\n'
+                            for q, p in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')))
+        return (
+            f'host_monitor_up{{{labels}}} {int(host.up)}\n',
+            state,
+            quantiles + f'host_monitor_rtt_seconds_count{{{labels}}} {rtt.received}\n'
+                        f'host_monitor_rtt_seconds_sum{{{labels}}} {number(rtt.total / 1000)}\n',
+            f'host_monitor_loss_ratio{{{labels}}} {number(stats["loss"])}\n',
+            f'host_monitor_jitter_seconds{{{labels}}} {number(stats["jitter"] / 1000)}\n',
+            f'host_monitor_pings_total{{{labels}}} {rtt.count}\n',
+            f'host_monitor_state_changes_total{{{labels}}} {host.state_changes}\n',
+            f'host_monitor_probe_errors_total{{{labels}}} {host.probe_errors}\n',
+            '', '', '', '',
+        )
+
+    @staticmethod
+    def vpn_fragments(vpn, labels):
+        state = ''.join(f'host_monitor_vpn_state{{{labels},host_monitor_vpn_state="{name}"}} {int(vpn.state == name)}\n'
+                        for name in vpn_states)
+        commands = ''.join(f'host_monitor_vpn_commands_total{{{labels},result="{result}"}} {count}\n'
+                           for result, count in vpn.command_results.items())
+        command = vpn.command
+        last = ('', '')
+        if command and command.duration is not None:
+            exit_code = number(float('nan') if command.returncode is None else command.returncode)
+            last = (f'host_monitor_vpn_last_command_exit_code{{{labels}}} {exit_code}\n',
+                    f'host_monitor_vpn_last_command_duration_seconds{{{labels}}} {number(command.duration)}\n')
+        return ('', '', '', '', '', '', '', '', state, commands) + last
+
+
+def start_exporter(monitor, listen):
+    try:
+        exporter = MetricsExporter(monitor, listen)
+    except (OSError, ValueError) as e:
+        print(f"Cannot serve metrics on {listen}: {e}", file=sys.stderr)
+        return None
+    exporter.start()
+    return exporter
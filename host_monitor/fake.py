@@ -0,0 +1,112 @@
+import itertools
+import random
+from heapq import heappush, heappop
+from threading import Thread, Condition
+from time import monotonic
+
+from host_monitor.profiler import timer
+from host_monitor.scheduler import Scheduler
+
+
+class FakeTarget(object):
+    # Simulated host, parameters are given after '#' in its address,
+    # e.g. 10.0.0.1#latency=20,jitter=5,loss=0.01,flap=60,outage=600:30
+    #  * latency, jitter: mean and standard deviation of the round-trip time (ms),
+    #  * loss: probability of a lost ping,
+    #  * flap: the host is down for the second half of every X seconds,
+    #  * outage: period:duration, the host is down for the last duration seconds of every period.
+    options = ('latency', 'jitter', 'loss', 'flap')
+
+    def __init__(self, address):
+        self.latency = 10.0
+        self.jitter = 2.0
+        self.loss = 0.0
+        self.flap = 0.0
+        self.outage = (0.0, 0.0)
+        _, _, options = address.partition('#')
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            if key == 'outage':
+                period, _, duration = value.partition(':')
+                self.outage = (float(period), float(duration))
+            elif key in self.options:
+                setattr(self, key, float(value))
+            else:
+                raise ValueError(f"unknown fake host option: {key}")
+
+    def reachable(self, t):
+        if self.flap and t % self.flap >= self.flap / 2:
+            return False
+        period, duration = self.outage
+        return not (period and t % period >= period - duration)
+
+    def rtt(self):
+        return max(random.gauss(self.latency, self.jitter), 0.01)
+
+
+class FakeEngine(Thread):
+    # Drop-in replacement of IcmpEngine (probe_backend: fake) answering from simulated hosts instead of
+    # the network. Probes go through the real Scheduler, so only the sockets are simulated.
+    timeout = 1  # seconds until a lost ping is reported, as IcmpEngine
+
+    def __init__(self):
+        super(FakeEngine, self).__init__(name='fake-engine')
+        self.daemon = True
+        self.scheduler = Scheduler()
+        self.targets = {}  # probe -> FakeTarget
+        self.replies = []  # heap of (arrival time, order, probe, rtt or None for a timeout)
+        self.order = itertools.count()
+        self.condition = Condition()
+        self.start_time = monotonic()
+        self.sent = 0
+
+    def add(self, probe):
+        try:
+            self.targets[probe] = FakeTarget(probe.address)
+        except ValueError as e:
+            probe.probe_error(e)
+            return
+        probe.resolved_address = probe.address.partition('#')[0]
+        probe.address_changed.emit(probe)
+        self.scheduler.add(probe, monotonic())
+        with self.condition:
+            self.condition.notify()
+
+    def remove(self, probe):
+        self.scheduler.remove(probe)
+        self.targets.pop(probe, None)
+
+    def update(self, probe, ping_success, rtt=None):
+        if probe.update(ping_success, rtt):
+            self.scheduler.changed(probe)
+
+    def send_due(self, now):
+        with timer('scheduler.due'):
+            due = self.scheduler.due(now)
+        for probe in due:
+            target = self.targets.get(probe)
+            if target is None:
+                continue
+            self.sent += 1
+            if target.reachable(now - self.start_time) and random.random() >= target.loss:
+                rtt = target.rtt()
+                heappush(self.replies, (now + rtt / 1000, next(self.order), probe, rtt))
+            else:
+                heappush(self.replies, (now + self.timeout, next(self.order), probe, None))
+
+    def deliver(self, now):
+        while self.replies and self.replies[0][0] <= now:
+            _, _, probe, rtt = heappop(self.replies)
+            if probe in self.targets:
+                self.update(probe, rtt is not None, rtt)
+
+    def run(self):
+        while True:
+            now = monotonic()
+            self.send_due(now)
+            self.deliver(now)
+            deadline = self.scheduler.next_deadline(now) or now + self.scheduler.max_interval
+            if self.replies:
+                deadline = min(deadline, self.replies[0][0])
+            with self.condition:
+                self.condition.wait(max(deadline - monotonic(), 0))
@@ -1,15 +1,23 @@
 import sys
 import types
-from threading import Thread
+import weakref
+from collections import deque
+from threading import Lock
+from time import monotonic
 
 from PyQt5.QtCore import *
-from PyQt5.QtGui import QColor
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QImage, QPainter, QPixmap
 from PyQt5.QtWidgets import *
 
+from host_monitor import events, startup
 from host_monitor.config import config, args
-from host_monitor.host import Host, VPN
+from host_monitor.host import PROBE_ERROR, DEGRADED, UNREACHABLE
+from host_monitor.monitor import Monitor
+from host_monitor.profiler import timer, record
+from host_monitor.stats import format_stats
 
 application = QApplication(sys.argv)
+startup.phase('qt')
 
 
 def flag_set(flags, flag):
@@ -34,98 +42,364 @@ def set_bg_color(widget, color):
     widget.setPalette(p)
 
 
-class HostLabel(QLabel):
+def display_state(host):
+    # VPN state machine states map to up (True), down (False) and in progress (None)
+    if host.is_vpn:
+        return {'connected': True, 'disconnected': False}.get(host.state)
+    return host.state
+
+
+class HostListModel(QAbstractListModel):
+    # one row per host, group separators are empty rows
+    KindRole = Qt.UserRole
+    AddressRole = Qt.UserRole + 1
+    StateRole = Qt.UserRole + 2
+    RttRole = Qt.UserRole + 3
+
+    HOST_ROW = 'host'
+    VPN_ROW = 'vpn'
+    SPACER_ROW = 'spacer'
+
+    modes = {
+        Qt.Checked: "auto",
+        Qt.Unchecked: "disconnect",
+        Qt.PartiallyChecked: "ignore",
+    }
+
+    def __init__(self, monitor):
+        super(HostListModel, self).__init__()
+        self.hosts = {}
+        self.rows = []  # host ids, None for spacers
+        self.row_of = {}
+        self.states = {}
+        self.reset(monitor)
+
+    def reset(self, monitor):
+        self.beginResetModel()
+        self.hosts = monitor.hosts
+        self.rows = []
+        self.row_of = {}
+        self.states = {}
+        for group_id, group in enumerate(monitor.groups):
+            if group_id > 0:
+                self.rows.append(None)
+            for host_id in group:
+                self.row_of[host_id] = len(self.rows)
+                self.rows.append(host_id)
+                self.states[host_id] = display_state(self.hosts[host_id])
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def flags(self, index):
+        host_id = self.rows[index.row()]
+        if host_id is None:
+            return Qt.NoItemFlags
+        if self.hosts[host_id].is_vpn:
+            return Qt.ItemIsEnabled | Qt.ItemIsUserCheckable | Qt.ItemIsUserTristate
+        return Qt.ItemIsEnabled
+
+    def data(self, index, role=Qt.DisplayRole):
+        host_id = self.rows[index.row()]
+        if host_id is None:
+            return self.SPACER_ROW if role == self.KindRole else None
+        host = self.hosts[host_id]
+        is_vpn = host.is_vpn
+
+        if role == Qt.DisplayRole:
+            return host_id[1]
+        elif role == self.KindRole:
+            return self.VPN_ROW if is_vpn else self.HOST_ROW
+        elif role == self.AddressRole:
+            if is_vpn:
+                return "VPN"
+            if host.resolved_address and host.resolved_address != host.address:
+                return f"{host.address} ({host.resolved_address})"
+            return host.address
+        elif role == self.StateRole:
+            return self.states[host_id]
+        elif role == self.RttRole:
+            return None if is_vpn else host.rtt
+        elif role == Qt.CheckStateRole and is_vpn:
+            return {v: k for k, v in self.modes.items()}[host.mode]
+        elif role == Qt.ToolTipRole:
+            if is_vpn:
+                return """VPN connection mode.
+ * Unchecked = Disconnect
+ * Part-checked = Ignore
+ * Checked = Auto-connect"""
+            unreachable = ""
+            if host.state == UNREACHABLE:
+                unreachable = f"unreachable, {host.parent.id[1]} is down\n" if host.parent else \
+                    "unreachable (parent down)\n"
+            if host.rtt is None:
+                return unreachable + "Statistics are kept by the daemon"
+            # latency statistics are computed only when the tooltip is shown
+            text = unreachable + format_stats(host.rtt.stats())
+            text += f"\nloss {host.loss.ratio:.0%} of the last {host.loss.size} pings"
+            uptime = host.history.uptime(24 * 3600) if host.history else None
+            if uptime is not None:
+                text += f"\nlast 24h uptime {uptime:.2%}"
+            if host.probe_errors:
+                text += f"\nprobe errors {host.probe_errors}, restarts {host.probe_restarts}"
+            return text
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        host_id = self.rows[index.row()]
+        if role != Qt.CheckStateRole or host_id is None or not self.hosts[host_id].is_vpn:
+            return False
+        self.hosts[host_id].mode = self.modes[Qt.CheckState(value)]
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def set_up(self, host_id, value):
+        if host_id not in self.row_of:  # removed by a config reload
+            return
+        self.states[host_id] = value
+        index = self.index(self.row_of[host_id])
+        self.dataChanged.emit(index, index)
+
+
+class Sparkline(object):
+    # Cached pixmap of the latest round-trip times of a probe, one bar of step pixels per ping. New pings scroll
+    # it left and only their bars are drawn; it is redrawn only when a new peak or the end of the old one
+    # changes the scale, or when more pings than fit arrived since the last paint.
+    step = 2
+    scales = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # ms at full height
+    bar_color = QColor(0, 0, 0, 90)
+    lost_color = QColor(255, 255, 255, 140)
+
+    def __init__(self, size):
+        self.pixmap = QPixmap(size)
+        self.pixmap.fill(Qt.transparent)
+        self.samples = deque(maxlen=size.width() // self.step)  # the rtts shown, NaN = lost
+        self.count = 0  # samples of the RttBuffer drawn
+        self.scale = self.scales[0]
+
+    def fit_scale(self):
+        peak = max((rtt for rtt in self.samples if rtt == rtt), default=0)
+        return next((scale for scale in self.scales if scale >= peak), self.scales[-1])
+
+    def update(self, rtt):
+        self.count, new = rtt.since(self.count)
+        if not new:
+            return
+        self.samples.extend(new)
+        scale = self.fit_scale()
+        painter = QPainter(self.pixmap)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        if scale != self.scale or len(new) >= self.samples.maxlen:
+            self.scale = scale
+            self.pixmap.fill(Qt.transparent)
+            self.draw(painter, self.samples)
+        else:
+            width = len(new) * self.step
+            self.pixmap.scroll(-width, 0, self.pixmap.rect())
+            painter.fillRect(self.pixmap.width() - width, 0, width, self.pixmap.height(), Qt.transparent)
+            self.draw(painter, new)
+        painter.end()
+
+    def draw(self, painter, samples):
+        # bars of the last samples at the right end
+        height = self.pixmap.height()
+        x = self.pixmap.width() - len(samples) * self.step
+        for rtt in samples:
+            if rtt != rtt:
+                painter.fillRect(x, 0, self.step, height, self.lost_color)
+            else:
+                bar = max(round(min(rtt / self.scale, 1) * height), 1)
+                painter.fillRect(x, height - bar, self.step, bar, self.bar_color)
+            x += self.step
+
+
+class HostDelegate(QStyledItemDelegate):
     colors = {
         None: QColor("#577e77"),
         False: QColor("#b32a22"),
         True: QColor("#32a35f"),
+        PROBE_ERROR: QColor("#a3832a"),
+        DEGRADED: QColor("#86a332"),
+        UNREACHABLE: QColor("#6b6f7e"),
     }
 
     icons = {
         None: QStyle.SP_MessageBoxQuestion,
         False: QStyle.SP_DialogCancelButton,
         True: QStyle.SP_DialogApplyButton,
+        PROBE_ERROR: QStyle.SP_MessageBoxWarning,
+        DEGRADED: QStyle.SP_MessageBoxInformation,
+        UNREACHABLE: QStyle.SP_MediaPause,
     }
 
-    def __init__(self, name, address):
-        QWidget.__init__(self)
-        self.name = name
-        self.address = address
-        self.setText("<big><b>{}</b></big><br/><small>{}</small>".format(name, address))
-        self.setAlignment(Qt.AlignCenter)
-
-        layout = QHBoxLayout()
-        self.setLayout(layout)
-        layout.setAlignment(Qt.AlignRight)
-        layout.setSpacing(0)
-        layout.setContentsMargins(0, 0, 0, 0)
-        layout.setStretch(0, 0)
-
-        self.icon = QLabel()
-        self.icon.setFixedSize(16, 16)
-        layout.addWidget(self.icon)
-
-        self.init_icons()
-        self.current_up = None
-        self.set_up(None)
+    check_states = {
+        Qt.Checked: QStyle.State_On,
+        Qt.Unchecked: QStyle.State_Off,
+        Qt.PartiallyChecked: QStyle.State_NoChange,
+    }
 
-    def showEvent(self, event):
-        self.set_up(self.current_up)
+    # same order as QCheckBox in tri-state mode
+    next_check_state = {
+        Qt.Unchecked: Qt.PartiallyChecked,
+        Qt.PartiallyChecked: Qt.Checked,
+        Qt.Checked: Qt.Unchecked,
+    }
 
-    def init_icons(self):
+    spacing = 10  # height of group separators
+    padding = 5
+    sparkline_row = 16
+
+    def __init__(self, parent):
+        super(HostDelegate, self).__init__(parent)
+        self.name_font = QFont("Consolas", 14, QFont.Bold)
+        self.name_font.setStyleHint(QFont.TypeWriter)
+        self.address_font = QFont("Consolas", 10, QFont.Bold)
+        self.address_font.setStyleHint(QFont.TypeWriter)
+        self.name_height = QFontMetrics(self.name_font).height()
+        self.address_height = QFontMetrics(self.address_font).height()
+        self.rtt_width = QFontMetrics(self.address_font).width("9999 ms")
+        # attached GUIs have no round-trip times, the daemon keeps them
+        self.sparkline_height = self.sparkline_row \
+            if config['settings']['sparkline_refresh'] > 0 and args.attach is None else 0
+        self.sparklines = weakref.WeakKeyDictionary()  # RttBuffer -> Sparkline, shared by hosts of one address
+        self.row_height = self.name_height + self.address_height + self.sparkline_height
+        self.init_icons(parent.style())
+
+    def init_icons(self, style):
         if not isinstance(self.icons[None], int):
             return
         for key, icon in self.icons.items():
-            icon = self.style().standardIcon(icon)
+            icon = style.standardIcon(icon)
             icon = icon.pixmap(QSize(16, 16))
             self.icons[key] = icon
 
-    def set_up(self, value):
-        self.current_up = value
-        if self.isVisible():
-            self.icon.setPixmap(self.icons[value])
-            color = self.colors[value].name()
-            self.setStyleSheet(f"background-color: {color}")
-
-
-class HostMiniLabel(QWidget):
-    def __init__(self):
-        QWidget.__init__(self)
-
-    def set_up(self, value):
-        set_bg_color(self, HostLabel.colors[value])
-
-
-class VPNLabel(HostLabel):
-    modes = {
-        Qt.CheckState.Checked: "auto",
-        Qt.CheckState.Unchecked: "disconnect",
-        Qt.CheckState.PartiallyChecked: "ignore",
-    }
-
-    def __init__(self, name, address, vpn):
-        super().__init__(name, address)
+    def sizeHint(self, option, index):
+        if index.data(HostListModel.KindRole) == HostListModel.SPACER_ROW:
+            return QSize(0, self.spacing)
+        return QSize(0, self.row_height)
 
-        self.vpn = vpn
-
-        self.checkbox = QCheckBox()
-        self.checkbox.setTristate(True)
-        self.checkbox.setCheckState({v: k for k, v in self.modes.items()}[self.vpn.mode])
-        self.checkbox.setToolTip("""VPN connection mode.
- * Unchecked = Disconnect
- * Part-checked = Ignore
- * Checked = Auto-connect""")
-        self.checkbox.stateChanged.connect(self.checked_changed)
-        self.layout().insertWidget(0, self.checkbox)
+    def check_rect(self, rect):
+        size = QApplication.style().pixelMetric(QStyle.PM_IndicatorWidth)
+        return QRect(rect.left() + self.padding, rect.top() + (rect.height() - size) // 2, size, size)
 
-    def checked_changed(self, state):
-        self.vpn.mode = self.modes[state]
+    def paint(self, painter, option, index):
+        kind = index.data(HostListModel.KindRole)
+        if kind == HostListModel.SPACER_ROW:
+            return
+        rect = option.rect
+        state = index.data(HostListModel.StateRole)
+
+        painter.save()
+        painter.fillRect(rect, self.colors[state])
+
+        if kind == HostListModel.VPN_ROW:
+            check = QStyleOptionButton()
+            check.rect = self.check_rect(rect)
+            check.state = QStyle.State_Enabled | self.check_states[index.data(Qt.CheckStateRole)]
+            QApplication.style().drawPrimitive(QStyle.PE_IndicatorCheckBox, check, painter)
+
+        icon = self.icons[state]
+        painter.drawPixmap(rect.right() - icon.width() + 1, rect.top() + (rect.height() - icon.height()) // 2, icon)
+
+        painter.setPen(QColor("black"))
+        text_rect = rect.adjusted(self.padding, 0, -self.padding, 0)
+        painter.setFont(self.name_font)
+        painter.drawText(text_rect.adjusted(0, 0, 0, self.name_height - text_rect.height()), Qt.AlignCenter,
+                         index.data(Qt.DisplayRole))
+        painter.setFont(self.address_font)
+        painter.drawText(text_rect.adjusted(0, self.name_height, 0, self.name_height + self.address_height -
+                                            text_rect.height()), Qt.AlignCenter,
+                         index.data(HostListModel.AddressRole))
+        rtt = index.data(HostListModel.RttRole)
+        if self.sparkline_height and rtt is not None:
+            self.paint_sparkline(painter, text_rect.adjusted(0, self.name_height + self.address_height,
+                                                             -icon.width(), -1), rtt, state)
+        painter.restore()
+
+    def paint_sparkline(self, painter, rect, rtt, state):
+        last = rtt.last()
+        if state == UNREACHABLE:  # not probed, the last round-trip time is outdated
+            text = ""
+        elif last is None:
+            text = "lost" if rtt.count else ""
+        else:
+            text = f"{last:.1f} ms" if last < 10 else f"{last:.0f} ms"
+        painter.drawText(rect, Qt.AlignRight | Qt.AlignVCenter, text)
+        size = QSize(max(rect.width() - self.rtt_width - self.padding, Sparkline.step), rect.height())
+        sparkline = self.sparklines.get(rtt)
+        if sparkline is None or sparkline.pixmap.size() != size:  # new or resized
+            sparkline = self.sparklines[rtt] = Sparkline(size)
+        sparkline.update(rtt)
+        painter.drawPixmap(rect.topLeft(), sparkline.pixmap)
+
+    def stale(self, rtt):
+        sparkline = self.sparklines.get(rtt)
+        return sparkline is None or sparkline.count != rtt.count
+
+    def editorEvent(self, event, model, option, index):
+        if index.data(HostListModel.KindRole) != HostListModel.VPN_ROW:
+            return False
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            if self.check_rect(option.rect).contains(event.pos()):
+                state = self.next_check_state[index.data(Qt.CheckStateRole)]
+                return model.setData(index, state, Qt.CheckStateRole)
+        return event.type() in (QEvent.MouseButtonPress, QEvent.MouseButtonDblClick)
+
+
+class HostListView(QListView):
+    # only the rows in the viewport are painted
+    def __init__(self, model):
+        super(HostListView, self).__init__()
+        self.setModel(model)
+        self.setItemDelegate(HostDelegate(self))
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(200)
+        self.sparkline_timer = QTimer()
+        self.sparkline_timer.timeout.connect(self.refresh_sparklines)
+        if self.itemDelegate().sparkline_height:
+            self.sparkline_timer.start(int(config['settings']['sparkline_refresh'] * 1000))
+
+    def refresh_sparklines(self):
+        # repaints the visible rows with new pings, their sparklines are extended when painted
+        if not self.isVisible():
+            return
+        with timer('gui.sparklines'):
+            model = self.model()
+            first = self.indexAt(QPoint(0, 0)).row()
+            last = self.indexAt(QPoint(0, self.viewport().height() - 1)).row()
+            if first < 0:
+                return
+            for row in range(first, last + 1 if last >= 0 else model.rowCount()):
+                index = model.index(row)
+                rtt = index.data(HostListModel.RttRole)
+                if rtt is not None and self.itemDelegate().stale(rtt):
+                    self.update(index)
+
+    def paintEvent(self, event):
+        with timer('gui.paint'):
+            super(HostListView, self).paintEvent(event)
+
+    def content_height(self):
+        delegate = self.itemDelegate()
+        spacers = sum(1 for host_id in self.model().rows if host_id is None)
+        hosts = len(self.model().rows) - spacers
+        return spacers * delegate.spacing + hosts * delegate.row_height + 2 * self.frameWidth()
 
 
 class MiniWindow(QWidget):
     clicked = pyqtSignal()
     enter = pyqtSignal()
     leave = pyqtSignal()
+    painted = pyqtSignal()  # first paint
+
+    codes = (None, False, True, PROBE_ERROR, DEGRADED, UNREACHABLE)  # state of each code in the packed state array
+    code_of = {state: code for code, state in enumerate(codes)}
+    severity = (1, 3, 5, 4, 0, 2)  # codes from the worst state: down, probe error, unreachable, degraded, unknown, up
 
     def __init__(self):
         QWidget.__init__(self, None, Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
@@ -134,12 +408,18 @@ class MiniWindow(QWidget):
         self.setFixedSize(*size)
         self.set_position()
 
-        layout = QGridLayout()
-        layout.setSpacing(0)
-        self.setLayout(layout)
-        self.setContentsMargins(0, 0, 0, 0)
-        layout.setContentsMargins(0, 0, 0, 0)
-        self.labels = {}
+        # host states are kept packed, one byte per host, and drawn into a one pixel high image of the
+        # strip; a state change repaints only the pixels of its host (or group)
+        self.states = bytearray()
+        self.index_of = {}  # host id -> index in states
+        self.group_of = []  # index -> group
+        self.groups = []  # (first index, end index) of each group
+        self.group_counts = []  # number of hosts in each state, per group
+        self.group_summary = False
+        self.was_painted = False
+        self.image = QImage(size[0], 1, QImage.Format_Indexed8)
+        self.image.setColorTable([HostDelegate.colors[state].rgb() for state in self.codes])
+        self.image.fill(0)
 
         self.show()
         self.raise_()
@@ -154,13 +434,85 @@ class MiniWindow(QWidget):
         self.timer_move.timeout.connect(self.set_position)
         self.timer_move.start()
 
-    def addLabel(self, host_id):
-        label = self.labels[host_id] = HostMiniLabel()
-        self.layout().addWidget(label, 0, len(self.labels) - 1)
-        return label
-
-    def set_up(self, name, value):
-        self.labels[name].set_up(value)
+    def set_hosts(self, groups, states):
+        # groups of host ids, states: host id -> state
+        self.states = bytearray(self.code_of[states[host_id]] for group in groups for host_id in group)
+        self.index_of = {}
+        self.group_of = []
+        self.groups = []
+        self.group_counts = []
+        for group_id, group in enumerate(groups):
+            start = len(self.index_of)
+            counts = [0] * len(self.codes)
+            for host_id in group:
+                self.index_of[host_id] = len(self.group_of)
+                self.group_of.append(group_id)
+                counts[self.states[self.index_of[host_id]]] += 1
+            self.groups.append((start, len(self.index_of)))
+            self.group_counts.append(counts)
+        self.group_summary = config['settings']['mini_group_summary'] and len(self.states) > self.image.width()
+        self.draw(0, self.image.width())
+
+    def set_up(self, host_id, value):
+        index = self.index_of.get(host_id)
+        if index is None:  # removed by a config reload
+            return
+        code = self.code_of[value]
+        old_code = self.states[index]
+        if code == old_code:
+            return
+        self.states[index] = code
+        counts = self.group_counts[self.group_of[index]]
+        counts[old_code] -= 1
+        counts[code] += 1
+        if self.group_summary:
+            self.draw(*self.group_columns(self.group_of[index]))
+        else:
+            self.draw(*self.host_columns(index))
+
+    def host_columns(self, index):
+        # pixel x shows hosts x * hosts // width .. (x + 1) * hosts // width (at least one)
+        width, hosts = self.image.width(), len(self.states)
+        end = -(-(index + 1) * width // hosts)
+        return min(-(-index * width // hosts), end - 1), end
+
+    def group_columns(self, group_id):
+        # pixel x shows group x * groups // width, groups may get no pixel at all
+        width, groups = self.image.width(), len(self.groups)
+        return -(-group_id * width // groups), -(-(group_id + 1) * width // groups)
+
+    def draw(self, start, end):
+        # recomputes the pixels start..end of the image
+        width, hosts = self.image.width(), len(self.states)
+        for x in range(start, end):
+            if not hosts:
+                code = 0
+            elif self.group_summary:
+                # each group is a bar of the shares of its hosts in each state, worst states first
+                group_id = x * len(self.groups) // width
+                group_start, group_end = self.group_columns(group_id)
+                position = (x - group_start + 0.5) / (group_end - group_start) * sum(self.group_counts[group_id])
+                for code in self.severity:
+                    position -= self.group_counts[group_id][code]
+                    if position < 0:
+                        break
+                else:  # empty group
+                    code = 0
+            else:
+                # more hosts than pixels: the worst state of the hosts sharing the pixel
+                first, last = x * hosts // width, max((x + 1) * hosts // width, x * hosts // width + 1)
+                code = min(self.states[first:last], key=self.severity.index)
+            self.image.setPixel(x, 0, code)
+        self.update(QRect(start * self.width() // width, 0,
+                          (end - start) * self.width() // width + 1, self.height()))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawImage(self.rect(), self.image)
+        if not self.was_painted:
+            self.was_painted = True
+            startup.phase('first paint')
+            self.painted.emit()
 
     def set_position(self):
         position = list(config['settings']['mini_position'])
@@ -180,15 +532,18 @@ class MiniWindow(QWidget):
 
 class MainWindow(QWidget):
     run_on_gui_signal = pyqtSignal(types.FunctionType, tuple, dict)
-    ping_changed_signal = pyqtSignal(Thread, object)
+    ping_changed_signal = pyqtSignal()
 
     NORMAL = 'normal'
     HIDDEN = 'hidden'
     PREVIEW = 'preview'
 
-    def __init__(self):
+    build_list_timeout = 1000  # ms
+
+    def __init__(self, monitor):
         super(MainWindow, self).__init__()
         self.is_previewing = False
+        self.monitor = monitor
 
         self.setWindowTitle('Host monitor')
         self.setMinimumWidth(config['settings']['width'])
@@ -197,87 +552,67 @@ class MainWindow(QWidget):
         MainWindow {
              background: #2b3f3b;
         }
-        HostLabel {
-            font-size: 12pt; 
-            font-family: Consolas, Monospace, TypeWriter, Courier; 
-            font-weight: bold; 
-            color: black;
-            margin: 0 0;
-            padding: 0 5;
+        HostListView {
             background: #2b3f3b;
-        }
-        QCheckBox {
-            margin: 0 0;
+            border: none;
         }
         """)
 
+        # state changes are collected from probe threads and painted at most gui_max_fps times per second
+        self.dirty = {}
+        self.dirty_lock = Lock()
+        self.dirty_since = None  # time of the first change since the last flush
+        self.coalesced_updates = 0
+        self.coalesced_total = 0  # shown in the tooltip of the window
+        self.last_flush = 0
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush_changes)
+
         self.run_on_gui_signal.connect(self.run_on_gui_slot)
         self.ping_changed_signal.connect(self.ping_changed_slot)
+        events.state_changed.subscribe(self.state_changed)
+        events.host_changed.subscribe(lambda host: host.id and self.state_changed(host, host.state))
+        events.hosts_changed.subscribe(lambda monitor: run_on_gui(lambda: self.hosts_changed()))
 
         layout = QVBoxLayout()
         layout.setSpacing(0)
+        layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
+        # probing starts with the mini window, the host list is built after its first paint
+        self.hosts = monitor.hosts
+        self.model = None
+        self.view = None
         self.mini_window = MiniWindow()
         self.mini_window.clicked.connect(self.restore)
         self.mini_window.enter.connect(self.preview)
         self.mini_window.leave.connect(self.close_preview)
+        self.mini_window.painted.connect(self.build_list, Qt.QueuedConnection)
+        QTimer.singleShot(self.build_list_timeout, self.build_list)  # in case the mini window is never painted
+        self.layout_hosts()
+        startup.phase('widgets')
 
-        self.labels = {}
-        self.hosts = {}
-
-        for group_id, host_group in enumerate(config['groups']):
-
-            if group_id > 0:
-                spacer = QWidget()
-                spacer.setFixedHeight(10)
-                layout.addWidget(spacer)
-
-            for definition in host_group['hosts']:
-                type = definition['type']
-
-                if type == 'internet-monitor':
-                    name = 'INTERNET'
-                    address = definition['address']
-                    host_id = (group_id, name)
-                    label = HostLabel(name, address)
-                    host = Host(host_id, address)
-
-                elif type == 'vpn':
-                    name = definition['name']
-                    vpn_ip = definition['assigned_ip']
-                    exclude_ips = definition['exclude_ips']
-                    ping_ip = definition['ping_ip']
-                    vpn_connect = definition['connect']
-                    vpn_disconnect = definition['disconnect']
-                    mode = definition['mode']
-                    host_id = (group_id, name)
-                    host = VPN(host_id, exclude_ips, vpn_ip, ping_ip, vpn_connect, vpn_disconnect, mode)
-                    label = VPNLabel(name, "VPN", host)
-
-                elif type == 'host':
-                    name = definition['name']
-                    address = definition['address']
-                    host_id = (group_id, name)
-                    label = HostLabel(name, address)
-                    host = Host(host_id, address)
-
-                else:
-                    raise Exception(f"Unknown host type: {type}")
-
-                self.labels[host_id] = label
-                layout.addWidget(label)
-
-                self.mini_window.addLabel(host_id)
-                self.hosts[host_id] = host
+        startup.watch(monitor)
+        monitor.start()
+        startup.phase('probes started')
 
         self.showNormal()
         self.center()
         self.setWindowFlag(Qt.WindowStaysOnTopHint, True)
         self.close_preview()
 
-        for host in self.hosts.values():
-            host.start()
+    def build_list(self):
+        if self.view:
+            return
+        with timer('gui.build_list'):
+            self.model = HostListModel(self.monitor)
+            self.view = HostListView(self.model)
+            self.layout().addWidget(self.view)
+            self.layout_hosts()
+            self.adjustSize()
+            self.center()
+        startup.phase('host list')
 
     @property
     def state(self):
@@ -290,14 +625,72 @@ class MainWindow(QWidget):
 
     @pyqtSlot(types.FunctionType, tuple, dict)
     def run_on_gui_slot(self, func, args, kwargs):
-        func(*args, **kwargs)
-
-    @pyqtSlot(Host, object)
-    def ping_changed_slot(self, host, up):
-        if args.verbose and isinstance(host, VPN):
-            print(f"{host.__class__.__name__} '{host.id[1]}' up state: {up}")
-        self.labels[host.id].set_up(up)
-        self.mini_window.set_up(host.id, up)
+        with timer('gui.run_on_gui'):
+            func(*args, **kwargs)
+
+    def state_changed(self, host, up):
+        # called on probe threads: only the first change since the last flush posts a signal
+        with self.dirty_lock:
+            if host.id in self.dirty:
+                self.coalesced_updates += 1
+            notify = not self.dirty
+            self.dirty[host.id] = (host, up)
+            if notify:
+                self.dirty_since = monotonic()
+        if notify:
+            self.ping_changed_signal.emit()
+
+    @pyqtSlot()
+    def ping_changed_slot(self):
+        if self.flush_timer.isActive():
+            return
+        fps = config['settings']['gui_max_fps']
+        wait = self.last_flush + 1 / fps - monotonic() if fps > 0 else 0
+        self.flush_timer.start(max(int(wait * 1000), 0))
+
+    def flush_changes(self):
+        self.last_flush = monotonic()
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, {}
+            coalesced, self.coalesced_updates = self.coalesced_updates, 0
+            if dirty:
+                record('gui.delivery', self.last_flush - self.dirty_since)
+        record('gui.dirty.depth', len(dirty))
+        record('gui.coalesced.count', coalesced)  # changes of hosts already waiting to be painted, not painted twice
+        if coalesced:
+            self.coalesced_total += coalesced
+            self.setToolTip(f"{self.coalesced_total} state updates coalesced (hosts changing again before being "
+                            f"painted, at most gui_max_fps {config['settings']['gui_max_fps']} times per second)")
+        with timer('gui.flush_changes'):
+            for host_id, (host, up) in dirty.items():
+                up = display_state(host)  # the latest state, VPN states of attached GUIs are not mapped yet
+                if args.verbose and host.is_vpn:
+                    print(f"{host.__class__.__name__} '{host.id[1]}' up state: {up}")
+                if self.model:  # otherwise the model reads the state when it is built
+                    self.model.set_up(host_id, up)
+                self.mini_window.set_up(host_id, up)
+
+    def layout_hosts(self):
+        if self.view:
+            screen_height = QApplication.desktop().availableGeometry(self).height()
+            self.view.setMinimumHeight(min(self.view.content_height(), int(screen_height * 0.8)))
+
+        self.mini_window.set_hosts(self.monitor.groups,
+                                   {host_id: display_state(host) for host_id, host in self.hosts.items()})
+
+    def hosts_changed(self):
+        # config reloaded: rows are rebuilt, hosts that kept running keep their state
+        with timer('gui.hosts_changed'):
+            self.rebuild()
+
+    def rebuild(self):
+        with self.dirty_lock:
+            self.dirty = {}
+        self.hosts = self.monitor.hosts
+        if self.model:
+            self.model.reset(self.monitor)
+        self.layout_hosts()
+        self.adjustSize()
 
     def center(self):
         frameGm = self.frameGeometry()
@@ -337,23 +730,16 @@ class MainWindow(QWidget):
         self.hide()
 
     def get_host(self, group=None, name=None, ip=None):
-        if group and name and (group, name) in self.hosts:
-            return self.hosts[group, name]
-
-        if name:
-            for (host_group, host_name), host in self.hosts.items():
-                if host_name == name:
-                    return host
-
-        if ip:
-            for host in self.hosts.values():
-                if getattr(host, "address", None) == ip:
-                    return host
-
-        return None
+        return self.monitor.get_host(group, name, ip)
 
 
-gui = MainWindow()
+if args.attach is None:
+    monitor = Monitor()
+else:
+    from host_monitor.client import RemoteMonitor
+    monitor = RemoteMonitor(args.attach or config['settings']['state_socket'])
+startup.phase('monitor')
+gui = MainWindow(monitor)
 
 
 def run_app():
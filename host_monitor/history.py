@@ -0,0 +1,264 @@
+import math
+import mmap
+import os
+import re
+import struct
+from threading import Thread, Lock, Event
+from time import time, monotonic
+
+from host_monitor.config import config
+from host_monitor.host import PROBE_ERROR
+
+NAN = float('nan')
+
+statuses = {
+    False: 0,
+    True: 1,
+    None: 2,
+    PROBE_ERROR: 3,
+}
+
+raw_record = struct.Struct('<dfB3x')  # time, rtt (ms, NaN = lost), status
+rollup_record = struct.Struct('<dIIfff4x')  # period start, pings, replies, rtt min, avg, max
+
+
+class RingFile(object):
+    # Fixed-size memory-mapped file of fixed-width records; the oldest records are overwritten. A file of another
+    # capacity (the history size setting changed) is resized, keeping its newest records.
+    header = struct.Struct('<8sIIQ')  # magic, record size, capacity, records written
+    magic = b'hmhist01'
+
+    def __init__(self, path, record, capacity):
+        self.record = record
+        records = ()
+        with open(path, 'a+b') as file:
+            file.seek(0)
+            header = file.read(self.header.size)
+            if len(header) == self.header.size:
+                magic, record_size, stored_capacity, count = self.header.unpack(header)
+                if magic != self.magic or record_size != record.size:
+                    count = 0
+                elif stored_capacity != capacity:
+                    data = file.read(record.size * stored_capacity)
+                    if len(data) == record.size * stored_capacity:
+                        records = [record.unpack_from(data, index % stored_capacity * record.size)
+                                   for index in range(count - min(count, stored_capacity, capacity), count)]
+                    count = 0
+            else:
+                count = 0
+            size = self.header.size + record.size * capacity
+            if count == 0 or os.fstat(file.fileno()).st_size != size:
+                count = 0
+                file.truncate(0)
+                file.truncate(size)  # sparse, disk space is used as records are written
+            self.mmap = mmap.mmap(file.fileno(), size)
+        self.capacity = capacity
+        self.count = count
+        self.header.pack_into(self.mmap, 0, self.magic, record.size, capacity, count)
+        for values in records:
+            self.append(*values)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def offset(self, index):
+        return self.header.size + (index % self.capacity) * self.record.size
+
+    def append(self, *values):
+        self.record.pack_into(self.mmap, self.offset(self.count), *values)
+        self.count += 1
+        struct.pack_into('<Q', self.mmap, 16, self.count)
+
+    def last(self):
+        if not self.count:
+            return None
+        return self.record.unpack_from(self.mmap, self.offset(self.count - 1))
+
+    def since(self, start, end=math.inf):
+        # records with start <= time < end, oldest first; the file is in time order so it is read backwards
+        records = []
+        count = self.count
+        for index in range(count - 1, max(count - self.capacity, 0) - 1, -1):
+            record = self.record.unpack_from(self.mmap, self.offset(index))
+            if record[0] < start:
+                break
+            if record[0] < end:
+                records.append(record)
+        records.reverse()
+        return records
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.mmap.close()
+
+
+def merge(records, period):
+    # group rollup records by period, combining pings, replies and rtt min/avg/max
+    buckets = {}
+    for start, pings, replies, rtt_min, rtt_avg, rtt_max in records:
+        key = start - start % period
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [key, pings, replies, rtt_min, rtt_avg, rtt_max]
+            continue
+        if replies:
+            if bucket[2]:
+                bucket[3] = min(bucket[3], rtt_min)
+                bucket[4] = (bucket[4] * bucket[2] + rtt_avg * replies) / (bucket[2] + replies)
+                bucket[5] = max(bucket[5], rtt_max)
+            else:
+                bucket[3:6] = rtt_min, rtt_avg, rtt_max
+        bucket[1] += pings
+        bucket[2] += replies
+    return [buckets[key] for key in sorted(buckets)]
+
+
+class History(object):
+    minute = 60
+    hour = 3600
+
+    def __init__(self, path):
+        settings = config['settings']
+        self.raw = RingFile(path + '.raw', raw_record, settings['history_raw_records'])
+        self.minutes = RingFile(path + '.1m', rollup_record, settings['history_minute_records'])
+        self.hours = RingFile(path + '.1h', rollup_record, settings['history_hour_records'])
+
+    def append(self, timestamp, rtt, state):
+        self.raw.append(timestamp, NAN if rtt is None else rtt, statuses.get(state, statuses[None]))
+
+    def rollup(self, now):
+        self.rollup_tier(self.raw, self.minutes, self.minute, now, raw=True)
+        self.rollup_tier(self.minutes, self.hours, self.hour, now)
+
+    def rollup_tier(self, source, target, period, now, raw=False):
+        last = target.last()
+        start = last[0] + period if last else 0
+        end = now - now % period  # the current period is still incomplete
+        records = source.since(start, end)
+        if raw:
+            records = [(timestamp, 1, 1, rtt, rtt, rtt) if status == statuses[True]
+                       else (timestamp, 1, 0, NAN, NAN, NAN)
+                       for timestamp, rtt, status in records]
+        for record in merge(records, period):
+            target.append(*record)
+
+    def load(self, seconds, now=None):
+        # records of the last seconds from the coarsest tier with enough resolution, oldest first
+        now = now or time()
+        if seconds <= 2 * self.hour:
+            records = self.raw.since(now - seconds)
+            return [(timestamp, 1, int(status == statuses[True]), rtt, rtt, rtt) for timestamp, rtt, status in records]
+        if seconds <= 7 * 24 * self.hour:
+            return self.minutes.since(now - seconds)
+        return self.hours.since(now - seconds)
+
+    def uptime(self, seconds):
+        records = self.load(seconds)
+        pings = sum(record[1] for record in records)
+        return sum(record[2] for record in records) / pings if pings else None
+
+    def flush(self):
+        for tier in (self.raw, self.minutes, self.hours):
+            tier.flush()
+
+    def close(self):
+        for tier in (self.raw, self.minutes, self.hours):
+            tier.close()
+
+
+class HistoryStore(Thread):
+    rollup_interval = 60
+
+    def __init__(self, directory):
+        super(HistoryStore, self).__init__(name='history')
+        self.daemon = True
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = Lock()
+        self.histories = {}  # path -> History, a file is mapped only once
+        self.pending = []  # probes waiting for their history
+        self.released = []  # stopped probes whose history is to be closed
+        self.wakeup = Event()
+
+    def attach(self, probe):
+        # opens the history of probe on the history thread, so that opening thousands of files does not
+        # delay probing at startup; the first pings of a new probe may be missing from its history
+        with self.lock:
+            self.pending.append(probe)
+        self.wakeup.set()
+
+    def detach(self, probe):
+        # closes the history of a stopped probe on the history thread, after a rollup or open in progress
+        with self.lock:
+            self.released.append(probe)
+        self.wakeup.set()
+
+    def path(self, address):
+        return os.path.join(self.directory, re.sub(r'[^\w.-]', '_', address))
+
+    def open(self, address):
+        path = self.path(address)
+        with self.lock:
+            if path not in self.histories:
+                self.histories[path] = History(path)
+            return self.histories[path]
+
+    def close(self, probe):
+        history, probe.history = probe.history, None
+        if history is None:  # stopped before its history was opened
+            return
+        with self.lock:
+            if self.histories.get(self.path(probe.address)) is history:
+                del self.histories[self.path(probe.address)]
+        try:
+            history.rollup(time())
+            history.flush()
+        except Exception:
+            pass
+        history.close()
+
+    def run(self):
+        next_rollup = monotonic()
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                pending, self.pending = self.pending, []
+                released, self.released = self.released, []
+            for probe in released:
+                self.close(probe)
+            for probe in pending:
+                if not probe.stopped:
+                    probe.history = self.open(probe.address)
+            if monotonic() >= next_rollup:
+                self.rollup()
+                next_rollup = monotonic() + self.rollup_interval
+            self.wakeup.wait(max(next_rollup - monotonic(), 0))
+
+    def rollup(self):
+        now = time()
+        with self.lock:
+            histories = list(self.histories.values())
+        for history in histories:
+            try:
+                history.rollup(now)
+                history.flush()
+            except Exception:
+                pass
+
+
+store_lock = Lock()
+store = None
+
+
+def get_store():
+    # None when history is disabled in settings
+    global store
+    with store_lock:
+        if store is None:
+            directory = config['settings']['history_dir']
+            store = HistoryStore(directory) if directory else False
+            if store:
+                store.start()
+        return store or None
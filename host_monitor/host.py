@@ -1,62 +1,263 @@
-import shlex
-import socket
-import subprocess as sp
-import sys
-from datetime import datetime
-from threading import Thread
-from time import sleep
-
+import math
+from queue import Queue, Empty
+from threading import Thread, Event
+from time import sleep, time, monotonic
+
+from host_monitor import events
+from host_monitor.addresses import get_local_addresses
+from host_monitor.command import Command
 from host_monitor.config import args, config
 from host_monitor.ping import Ping
+from host_monitor.profiler import timer, record
+from host_monitor.stats import RttBuffer, LossWindow
 
 
-class Host(Thread):
-    def __init__(self, id, address, start=False):
-        super(Host, self).__init__()
-        self.id = id
+PROBE_ERROR = 'error'  # host state when it cannot be probed at all (unknown host, ping not running, ...)
+DEGRADED = 'degraded'  # host state when it is up, but loses more than degraded_loss of the pings
+UNREACHABLE = 'unreachable'  # host state while the host it depends on is down, it is not probed then
+
+state_names = {  # host states as printed and alerted
+    None: "unknown",
+    False: "down",
+    True: "up",
+    PROBE_ERROR: "probe error",
+    DEGRADED: "degraded",
+    UNREACHABLE: "unreachable (parent down)",
+}
+
+
+class Probe(object):
+    # Probing of one target address, shared by all hosts, VPNs and exporters watching it (see Registry)
+    restart_min_delay = 1  # seconds before restarting a failed probe, doubled after each failure
+    restart_max_delay = 60
+    restart_reset_time = 60  # probes running this long without failure restart with the minimal delay
+
+    def __init__(self, address):
         self.address = address
-        self.daemon = True
+        self.resolved_address = None  # ip being pinged (hostnames are resolved in the background)
         self.state = None
-        self.ping = Ping(address)
-        if start:
-            self.start()
+        self.interval = None  # current effective probe interval (seconds), set by the scheduler
+        self.probe_errors = 0
+        self.probe_restarts = 0
+        self.state_changes = 0
+        self.stopped = False
+        self.suspended = False  # by Dependencies while the hosts using it are unreachable
+        self.resumed = Event()  # wakes up the ping subprocess thread
+        self.resumed.set()
+        self.ping = None
+        self.users = 0  # reference count kept by the registry
+        self.rtt = RttBuffer(config['settings']['rtt_samples'])
+        self.loss = LossWindow(config['settings']['loss_window'])
+        self.successes = 0  # consecutive replies
+        self.failures = 0  # consecutive lost pings
+        self.history = None
+        self.state_changed = events.Observable()  # (probe, new state)
+        self.address_changed = events.Observable()  # (probe) resolved address changed
+
+    def start(self):
+        engine = self.engine()
+        if engine:
+            engine.add(self)
+        else:
+            Thread(target=self.run, name=f"ping {self.address}", daemon=True).start()
+
+    def stop(self):
+        self.stopped = True
+        self.resumed.set()
+        engine = self.engine()
+        if engine:
+            engine.remove(self)
+        if self.ping:
+            self.ping.terminate()
+
+    def suspend(self):
+        # no probing until resume(), the state is unreachable meanwhile
+        self.suspended = True
+        self.resumed.clear()
+        engine = self.engine()
+        if engine:
+            engine.remove(self)
+        elif self.ping:
+            self.ping.terminate()
+        self.successes = self.failures = 0
+        self.set_state(UNREACHABLE)
+
+    def resume(self):
+        # probed again at once, the first reply or lost ping decides the state
+        self.suspended = False
+        self.resumed.set()
+        engine = self.engine()
+        if engine:
+            engine.add(self)
+
+    def engine(self):
+        # tcp/http/dns checks run on the check engine, pings on the probe engine (None for ping subprocesses)
+        from host_monitor.checks import get_checker, is_check
+        from host_monitor.icmp import get_engine
+        return get_checker() if is_check(self.address) else get_engine()
 
     def run(self):
-        from host_monitor.gui import gui
-        sleep(1)
-        while True:
+        # fallback without ICMP sockets: one supervised ping subprocess per probe
+        delay = self.restart_min_delay
+        while not self.stopped:
+            if self.suspended:
+                self.resumed.wait()
+                delay = self.restart_min_delay
+                continue
+            started = monotonic()
             try:
-                ping_success = self.ping.read()
-                if ping_success != self.state:
-                    if self.id:
-                        gui.ping_changed_signal.emit(self, ping_success)
-                    self.state = ping_success
-            except Exception:
-                pass
+                self.ping = Ping(self.address)
+                while not self.stopped and not self.suspended:
+                    self.update(*self.ping.read())
+            except Exception as e:  # EOFError when ping exits, e.g. on unknown host
+                if self.stopped:
+                    return
+                if not self.suspended:  # otherwise terminated by suspend()
+                    self.probe_error(e)
+            finally:
+                if self.ping:
+                    self.ping.terminate()
+            if self.suspended:
+                continue
+            if monotonic() - started > self.restart_reset_time:
+                delay = self.restart_min_delay
+            sleep(delay)
+            delay = min(delay * 2, self.restart_max_delay)
+            self.probe_restarts += 1
+
+    def probe_error(self, error):
+        self.probe_errors += 1
+        if args.verbose:
+            print(f"Probe of {self.address} failed: {error}")
+        return self.update(PROBE_ERROR)
+
+    @property
+    def up(self):
+        return self.state is True or self.state == DEGRADED
+
+    def update(self, ping_success, rtt=None):
+        # returns True if the host should be probed again soon: its state changed or a first ping was lost, not
+        # for its first status
+        with timer('probe.update'):
+            return self.update_state(ping_success, rtt)
+
+    def update_state(self, ping_success, rtt):
+        if self.suspended or self.stopped:  # a reply in flight when it was suspended or stopped
+            return False
+        if ping_success != PROBE_ERROR:
+            self.rtt.add(rtt if ping_success else None)
+            self.loss.add(not ping_success)
+            if ping_success:
+                self.successes += 1
+                self.failures = 0
+            else:
+                self.failures += 1
+                self.successes = 0
+        if self.history:
+            self.history.append(time(), rtt, ping_success)
+        first = self.state in (None, UNREACHABLE)
+        changed = self.set_state(self.next_state(ping_success))
+        return not first and (changed or (self.failures == 1 and not ping_success))
+
+    def set_state(self, state):
+        if state == self.state:
+            return False
+        self.state = state
+        self.state_changes += 1
+        self.state_changed.emit(self, state)
+        return True
 
+    def next_state(self, ping_success):
+        # hysteresis: an up host is down after state_down_after lost pings in a row, a down host is up again
+        # after state_up_after replies in a row; the first ping of an unknown or unreachable host decides at once.
+        # The loss ratio is only checked after a reply and left out of an outage: lost pings in a row are an
+        # outage, not a degraded host, neither before nor after it.
+        settings = config['settings']
+        if ping_success == PROBE_ERROR:
+            return PROBE_ERROR
+        if self.state in (None, PROBE_ERROR, UNREACHABLE):
+            if not ping_success:
+                return False
+        elif self.state is False:
+            if self.successes < settings['state_up_after']:
+                return False
+            self.loss.clear()
+        elif self.failures >= settings['state_down_after']:
+            self.loss.clear()
+            return False
+        elif self.failures:
+            return self.state
+        threshold = settings['recovered_loss'] if self.state == DEGRADED else settings['degraded_loss']
+        return DEGRADED if self.loss.ratio >= threshold else True
 
-class VPN(Thread):
-    check_timeout = 1
-    internet_connection_checks = 3
-    vpn_pings = 5
 
-    def __init__(self, id, exclude_ips, vpn_ip, ping_ip, connect, disconnect, mode):
-        super(VPN, self).__init__()
+class Host(object):
+    # A configured host; address, state, rtt, history, ... are those of the shared probe of its address
+    is_vpn = False
+    parent = None  # host, internet monitor or VPN it depends on (depends_on), set by Dependencies
+
+    def __init__(self, id, probe):
         self.id = id
+        self.probe = probe
+        self.state_changed = events.Observable()  # (host, new state)
+        probe.state_changed.subscribe(self.probe_changed)
+        probe.address_changed.subscribe(self.address_changed)
+
+    def __getattr__(self, name):
+        return getattr(self.probe, name)
+
+    def probe_changed(self, probe, state):
+        self.state_changed.emit(self, state)
+        events.state_changed.emit(self, state)
+
+    def address_changed(self, probe):
+        events.host_changed.emit(self)
+
+    def stop(self):
+        self.probe.state_changed.unsubscribe(self.probe_changed)
+        self.probe.address_changed.unsubscribe(self.address_changed)
+
+
+class VPN(Thread):
+    # Event-driven state machine: re-evaluated when its parent (depends_on, the internet monitor by default) or
+    # the VPN pinger changes state, when local addresses change, when the mode changes, when a command finishes
+    # and when a timer expires. It connects only while the parent is up.
+    # States: disconnected, connecting, connected, disconnecting.
+    check_interval = 10  # re-evaluate at least every X seconds
+    is_vpn = True
+
+    def __init__(self, id, exclude_ips, vpn_ip, ping_ip, connect, disconnect, mode, depends_on='INTERNET'):
+        super(VPN, self).__init__(name=f"vpn {id[1]}")
+        self.id = id
+        self.depends_on = depends_on  # name of the internet monitor, host or VPN it connects through
         self.exclude_ips = exclude_ips
         self.vpn_ip = vpn_ip
-        self.pinger = ping_ip
-        self.internet_monitor = None
+        self.ping_ip = ping_ip
+        self.pinger = None  # probe of ping_ip
+        self.parent = None
         self.connect = connect
         self.disconnect = disconnect
         self.daemon = True
-        self.mode = mode
-        self.state = None  # states: disconnected, connecting, connected, disconnecting
-        self.last_command_time = datetime(2000, 1, 1)
+        self.monitor = None
+        self.events = Queue()
+        self._mode = mode
+        self.state = None
+        self.command = None  # last (or currently running) connect/disconnect Command
+        self.command_results = {'success': 0, 'failure': 0, 'timeout': 0}  # finished commands
+        self.last_command_time = -math.inf
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        self._mode = mode
+        self.events.put('mode')
 
     @staticmethod
     def ip_addresses():
-        return set([ip for ip in socket.gethostbyname_ex(socket.gethostname())[2] if not ip.startswith("127.")])
+        return get_local_addresses().get()
 
     def have_excluded_ip(self, ips):
         for exclude_ip in self.exclude_ips:
@@ -66,16 +267,11 @@ class VPN(Thread):
         return False
 
     def is_internet_connected(self):
-        if not self.internet_monitor:
+        if not self.parent:
             return True
-
-        for i in range(self.internet_connection_checks):
-            if i > 0:
-                sleep(self.check_timeout)
-            if not self.internet_monitor.state:
-                return False
-
-        return True
+        if self.parent.is_vpn:
+            return self.parent.state == 'connected'
+        return self.parent.up
 
     def is_vpn_ip_assigned(self, ips):
         return any(ip.startswith(self.vpn_ip) for ip in ips)
@@ -89,88 +285,148 @@ class VPN(Thread):
             return True
 
         # ping inside vpn
-        for i in range(self.vpn_pings):
-            if i > 0:
-                sleep(self.check_timeout)
-            if self.pinger.state:
-                return True
+        return self.pinger.up
 
-        return False
+    def relink(self):
+        # look up the parent and the pinger again after the config changed
+        self.events.put('relink')
 
-    def run(self):
-        from host_monitor.gui import gui
+    def stop(self):
+        self.events.put('stop')
+
+    def host_changed(self, host, up):
+        self.events.put('host')
+
+    def parent_changed(self, host, up):
+        if host is self.parent:
+            self.events.put('host')
 
-        self.internet_monitor = gui.get_host(name="INTERNET")
+    def addresses_changed(self, addresses):
+        self.events.put('addresses')
 
+    def unlink_hosts(self, keep_pinger=None):
+        if self.parent:
+            events.state_changed.unsubscribe(self.parent_changed)
         if self.pinger:
-            self.pinger = gui.get_host(ip=self.pinger) or Host(None, self.pinger, True)
+            self.pinger.state_changed.unsubscribe(self.host_changed)
+        if self.pinger and self.pinger is not keep_pinger:
+            self.monitor.registry.release(self.pinger)
+        self.parent = self.pinger = None
+
+    def link_hosts(self):
+        # the pinger is the probe of ping_ip, shared with the host of that address if there is one
+        parent = self.monitor.get_host(self.id[0], self.depends_on) if self.depends_on else None
+        pinger = None
+        if self.ping_ip:
+            if self.pinger and self.pinger.address == self.ping_ip:
+                pinger = self.pinger  # keeps its state
+            else:
+                pinger = self.monitor.registry.probe(self.ping_ip)
+        self.unlink_hosts(keep_pinger=pinger)
+        self.parent = parent if parent is not self else None
+        self.pinger = pinger
+        if self.parent:  # VPNs have no state_changed of their own
+            events.state_changed.subscribe(self.parent_changed)
+        if self.pinger:
+            self.pinger.state_changed.subscribe(self.host_changed)
+
+    def run(self):
+        self.link_hosts()
+        get_local_addresses().changed.subscribe(self.addresses_changed)
 
         while True:
-            sleep(self.check_timeout)
+            received = set()
             try:
-                internet = self.is_internet_connected()
-
-                ips = self.ip_addresses()
-                vpn_ip_assigned = self.is_vpn_ip_assigned(ips)
-                vpn_running = self.is_vpn_running(ips)
-                command_waiting = (datetime.now() - self.last_command_time).total_seconds() < config['settings'][
-                    'vpn_wait_time']
-
-                if self.mode == "auto":
-                    shall_vpn = not self.have_excluded_ip(ips)
-                elif self.mode == "disconnect":
-                    shall_vpn = False
-                elif self.mode == "connect":
-                    shall_vpn = True
-                elif self.mode == "ignore":
-                    shall_vpn = vpn_running
-                else:
-                    raise Exception("Unknown VPN mode")
-
-                has_connected = shall_vpn and vpn_running and self.state != 'connected'
-                has_disconnected = not shall_vpn and not vpn_running and self.state != 'disconnected'
-                shall_connect = shall_vpn and not vpn_running and (
-                            self.state != 'connecting' or not command_waiting) and internet
-                shall_disconnect = not shall_vpn and vpn_ip_assigned and (
-                            self.state != 'disconnecting' or not command_waiting)
-
-                if has_connected:
-                    self.state = 'connected'
-                    gui.ping_changed_signal.emit(self, True)
-                elif has_disconnected:
-                    self.state = 'disconnected'
-                    gui.ping_changed_signal.emit(self, False)
-                elif shall_disconnect:
-                    gui.ping_changed_signal.emit(self, None)
-                    if args.verbose:
-                        print(f"Stopping VPN {self.id}")
-                    self.state = 'disconnecting'
-                    self.run_command(self.disconnect)
-                elif shall_connect:
-                    gui.ping_changed_signal.emit(self, None)
-                    if args.verbose:
-                        print(f"Starting VPN {self.id}")
-                    self.state = 'connecting'
-                    self.run_command(self.connect)
-
-            except Exception:
+                received.add(self.events.get(timeout=self.next_timeout()))
+                while True:  # coalesce events that arrived in the meantime
+                    received.add(self.events.get_nowait())
+            except Empty:
                 pass
 
-    def run_command(self, command):
-        if sys.platform == 'win32':
-            startupinfo = sp.STARTUPINFO()
-            startupinfo.dwFlags |= sp.STARTF_USESHOWWINDOW
-        else:
-            startupinfo = None
-
-        command = shlex.split(command)
+            if 'stop' in received:
+                self.unlink_hosts()
+                get_local_addresses().changed.unsubscribe(self.addresses_changed)
+                return
+            if 'relink' in received:
+                self.link_hosts()
 
-        self.last_command_time = datetime.now()
-
-        process = sp.Popen(command,
-                           stdout=sp.DEVNULL, stderr=sp.DEVNULL, shell=False, creationflags=sp.SW_HIDE,
-                           startupinfo=startupinfo, encoding='utf8')
-
-        ret_code = process.wait()
+            try:
+                with timer('vpn.evaluate'):
+                    self.evaluate()
+            except Exception as e:
+                if args.verbose:
+                    print(f"VPN {self.id} error: {e}")
+
+    def command_waiting(self):
+        if self.command and self.command.running:
+            return True
+        return monotonic() - self.last_command_time < config['settings']['vpn_wait_time']
+
+    def next_timeout(self):
+        wait_end = self.last_command_time + config['settings']['vpn_wait_time'] - monotonic()
+        return wait_end if 0 < wait_end < self.check_interval else self.check_interval
+
+    def evaluate(self):
+        internet = self.is_internet_connected()
+
+        ips = self.ip_addresses()
+        vpn_ip_assigned = self.is_vpn_ip_assigned(ips)
+        if vpn_ip_assigned and self.pinger and self.pinger.state is None:
+            return  # undecided until the pinger has reported, the VPN may be running already
+        vpn_running = self.is_vpn_running(ips)
+        command_waiting = self.command_waiting()
+
+        if self.mode == "auto":
+            shall_vpn = not self.have_excluded_ip(ips)
+        elif self.mode == "disconnect":
+            shall_vpn = False
+        elif self.mode == "connect":
+            shall_vpn = True
+        elif self.mode == "ignore":
+            shall_vpn = vpn_running
+        else:
+            raise Exception("Unknown VPN mode")
+
+        has_connected = shall_vpn and vpn_running and self.state != 'connected'
+        has_disconnected = not shall_vpn and not vpn_running and self.state != 'disconnected'
+        shall_connect = shall_vpn and not vpn_running and (
+                    self.state != 'connecting' or not command_waiting) and internet
+        shall_disconnect = not shall_vpn and vpn_ip_assigned and (
+                    self.state != 'disconnecting' or not command_waiting)
+
+        if has_connected:
+            self.state = 'connected'
+            events.state_changed.emit(self, True)
+        elif has_disconnected:
+            self.state = 'disconnected'
+            events.state_changed.emit(self, False)
+        elif self.command and self.command.running:
+            return  # never run connect and disconnect at the same time
+        elif shall_disconnect:
+            self.state = 'disconnecting'  # before the event, observers read it
+            events.state_changed.emit(self, None)
+            if args.verbose:
+                print(f"Stopping VPN {self.id}")
+            self.run_command(self.disconnect)
+        elif shall_connect:
+            self.state = 'connecting'  # before the event, observers read it
+            events.state_changed.emit(self, None)
+            if args.verbose:
+                print(f"Starting VPN {self.id}")
+            self.run_command(self.connect)
 
-        return ret_code == 0
+    def run_command(self, command):
+        self.last_command_time = monotonic()
+        self.command = Command(command, config['settings']['vpn_command_timeout'], self.command_done)
+        self.command.start()
+        return self.command
+
+    def command_done(self, command):
+        result = 'timeout' if command.timed_out else 'success' if command.success else 'failure'
+        self.command_results[result] += 1
+        record('vpn.command', command.duration)
+        if args.verbose:
+            print(f"VPN {self.id} command {command}")
+            if command.output:
+                print(command.output.rstrip())
+        self.events.put('command')
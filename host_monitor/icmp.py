@@ -0,0 +1,201 @@
+import itertools
+import os
+import select
+import socket
+import struct
+from collections import OrderedDict
+from multiprocessing import parent_process
+from threading import Thread, Lock
+from time import monotonic
+
+from host_monitor.config import config
+from host_monitor.profiler import timer
+from host_monitor.resolver import get_resolver, is_ip_address
+from host_monitor.scheduler import Scheduler
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+engine_lock = Lock()
+engine = None
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack("!{}H".format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def open_icmp_socket():
+    # unprivileged "ping socket" first (net.ipv4.ping_group_range), raw socket needs CAP_NET_RAW
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+
+class IcmpEngine(Thread):
+    timeout = 1  # seconds to wait for a reply (ping -W 1)
+    payload = b'\0'  # ping -s 1
+
+    def __init__(self):
+        super(IcmpEngine, self).__init__(name='icmp')
+        self.daemon = True
+        self.socket, self.raw = open_icmp_socket()
+        self.socket.setblocking(False)
+        self.icmp_id = os.getpid() & 0xffff
+        self.sequence = itertools.cycle(range(1, 0x10000))
+        self.scheduler = Scheduler()
+        self.targets = {}  # host -> resolved ip
+        self.watches = {}  # host -> resolver callback
+        self.pending = OrderedDict()  # sequence -> (host, send time), oldest first
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+
+    def add(self, host):
+        if is_ip_address(host.address):
+            self.add_target(host, host.address)
+        else:
+            # hostnames are re-resolved in the background when their TTL expires
+            callback = self.watches[host] = lambda name, ips, error: self.resolved(host, ips, error)
+            get_resolver().watch(host.address, callback)
+
+    def remove(self, host):
+        self.scheduler.remove(host)
+        self.targets.pop(host, None)
+        callback = self.watches.pop(host, None)
+        if callback:
+            get_resolver().unwatch(host.address, callback)
+
+    def resolved(self, host, ips, error):
+        if host.stopped:
+            return
+        if error:
+            if host not in self.targets:  # otherwise keep pinging the last known address
+                host.probe_error(error)
+            return
+        if self.targets.get(host) in ips:
+            return
+        if host in self.targets:
+            self.targets[host] = ips[0]
+            host.resolved_address = ips[0]
+            host.address_changed.emit(host)
+        else:
+            self.add_target(host, ips[0])
+
+    def add_target(self, host, ip):
+        self.targets[host] = ip
+        host.resolved_address = ip
+        host.address_changed.emit(host)
+        self.scheduler.add(host, monotonic())
+        self.wakeup_send.send(b'\0')
+
+    def packet(self, sequence):
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.icmp_id, sequence)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum(header + self.payload), self.icmp_id, sequence)
+        return header + self.payload
+
+    def send(self, host, now):
+        sequence = next(self.sequence)
+        while sequence in self.pending:
+            sequence = next(self.sequence)
+        try:
+            self.socket.sendto(self.packet(sequence), (self.targets[host], 0))
+        except OSError as e:  # no route, ...: retried with exponential backoff
+            if host.probe_error(e):
+                self.scheduler.changed(host)
+            self.scheduler.failed(host)
+            return
+        self.scheduler.succeeded(host)
+        self.pending[sequence] = (host, now)
+
+    def send_due(self, now):
+        with timer('scheduler.due'):
+            due = self.scheduler.due(now)
+        for host in due:
+            with timer('icmp.send'):
+                self.send(host, now)
+
+    def update(self, host, ping_success, rtt=None):
+        if host.update(ping_success, rtt):
+            self.scheduler.changed(host)
+
+    def expire(self, now):
+        while self.pending:
+            sequence, (host, send_time) = next(iter(self.pending.items()))
+            if now - send_time < self.timeout:
+                break
+            del self.pending[sequence]
+            if host in self.targets:
+                self.update(host, False)
+
+    def receive(self):
+        while True:
+            try:
+                data, (ip, _) = self.socket.recvfrom(1024)
+            except OSError:
+                return
+            if self.raw:
+                data = data[(data[0] & 0x0f) * 4:]  # strip the IP header
+            if len(data) < 8:
+                continue
+            type, code, _, ident, sequence = struct.unpack("!BBHHH", data[:8])
+            # ping sockets rewrite the identifier and deliver only their own replies
+            if type != ICMP_ECHO_REPLY or (self.raw and ident != self.icmp_id):
+                continue
+            pending = self.pending.get(sequence)
+            if pending is None or self.targets.get(pending[0]) != ip:
+                continue
+            del self.pending[sequence]
+            with timer('icmp.reply'):
+                self.update(pending[0], True, (monotonic() - pending[1]) * 1000)
+
+    def next_deadline(self, now):
+        deadline = self.scheduler.next_deadline(now) or now + self.scheduler.max_interval
+        if self.pending:
+            deadline = min(deadline, next(iter(self.pending.values()))[1] + self.timeout)
+        return deadline
+
+    def run(self):
+        while True:
+            now = monotonic()
+            self.send_due(now)
+            self.expire(now)
+            timeout = max(self.next_deadline(now) - monotonic(), 0)
+            readable, _, _ = select.select([self.socket, self.wakeup_recv], [], [], timeout)
+            if self.wakeup_recv in readable:
+                try:
+                    self.wakeup_recv.recv(4096)
+                except BlockingIOError:
+                    pass
+            if self.socket in readable:
+                self.receive()
+
+
+def get_engine():
+    # shared engine selected by probe_backend, None for ping subprocesses
+    # (also when ICMP sockets are not available); with probe_workers, the engine of the main process
+    # distributes targets to worker processes running the selected one
+    global engine
+    with engine_lock:
+        if engine is None:
+            backend = config['settings']['probe_backend']
+            if config['settings']['probe_workers'] and parent_process() is None:
+                from host_monitor.shards import ShardedEngine
+                engine = ShardedEngine(config['settings']['probe_workers'])
+            elif backend == 'fake':
+                from host_monitor.fake import FakeEngine
+                engine = FakeEngine()
+            elif backend == 'ping':
+                engine = False
+            else:
+                try:
+                    engine = IcmpEngine()
+                except OSError:
+                    engine = False
+            if engine:
+                engine.start()
+        return engine or None
@@ -10,8 +10,18 @@ if __package__ is None and not hasattr(sys, 'frozen'):
 
 
 def main():
-    from host_monitor.gui import run_app
-    ret_code = run_app()
+    from host_monitor import startup
+    from host_monitor.config import args
+    startup.phase('config')
+    if args.profile:
+        from host_monitor.profiler import start_profiler
+        start_profiler()
+    if args.headless:
+        from host_monitor.daemon import run_daemon
+        ret_code = run_daemon()
+    else:
+        from host_monitor.gui import run_app
+        ret_code = run_app()
     sys.exit(ret_code)
 
 
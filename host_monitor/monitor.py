@@ -0,0 +1,195 @@
+import sys
+from threading import Lock
+
+from host_monitor import events
+from host_monitor.config import config, config_path, load_config, args
+from host_monitor.dependencies import Dependencies
+from host_monitor.host import Host, VPN
+from host_monitor.registry import Registry
+from host_monitor.watcher import FileWatcher
+
+
+def host_key(definition):
+    # hosts are matched between config versions by type and name, regardless of their group
+    if definition['type'] == 'internet-monitor':
+        return definition['type'], 'INTERNET'
+    return definition['type'], definition['name']
+
+
+def probe_address(definition):
+    # address of the shared probe: the address to ping, or the URL of a tcp/http/dns check
+    type = definition['type']
+    if type == 'tcp':
+        address = f"tcp://{definition['address']}"
+    elif type == 'http':
+        address = definition['address']
+    elif type == 'dns':
+        address = f"dns://{definition['address']}/{definition['query']}"
+    else:
+        return definition['address']
+    if 'timeout' in definition:
+        address += f"#timeout={definition['timeout']}"
+    return address
+
+
+class Monitor(object):
+    def __init__(self):
+        self.groups = []  # host ids of each group, in config order
+        self.hosts = {}
+        self.definitions = {}  # host id -> config definition
+        self.lock = Lock()
+        self.started = False
+        self.registry = Registry()
+        self.dependencies = Dependencies()
+
+        for group_id, host_group in enumerate(config['groups']):
+            group = []
+            self.groups.append(group)
+
+            for definition in host_group['hosts']:
+                host = self.create_host(group_id, definition)
+                group.append(host.id)
+                self.hosts[host.id] = host
+                self.definitions[host.id] = definition
+        self.registry.index(self.hosts)
+        self.dependencies.link(self)
+
+    def create_host(self, group_id, definition):
+        type = definition['type']
+        host_id = (group_id, host_key(definition)[1])
+
+        if type == 'internet-monitor':
+            host = Host(host_id, self.registry.probe(definition['address']))
+
+        elif type == 'vpn':
+            vpn_ip = definition['assigned_ip']
+            exclude_ips = definition['exclude_ips']
+            ping_ip = definition['ping_ip']
+            vpn_connect = definition['connect']
+            vpn_disconnect = definition['disconnect']
+            mode = definition['mode']
+            depends_on = definition.get('depends_on', 'INTERNET')
+            host = VPN(host_id, exclude_ips, vpn_ip, ping_ip, vpn_connect, vpn_disconnect, mode, depends_on)
+            host.monitor = self
+
+        elif type in ('host', 'tcp', 'http', 'dns'):
+            host = Host(host_id, self.registry.probe(probe_address(definition)))
+
+        else:
+            raise Exception(f"Unknown host type: {type}")
+
+        return host
+
+    def stop_host(self, host):
+        host.stop()
+        if not isinstance(host, VPN):
+            self.registry.release(host.probe)
+
+    def start(self):
+        self.started = True
+        if config['settings']['alerts']:  # before probing, so that it sees the first statuses
+            from host_monitor.alerts import start_alerts
+            start_alerts(config['settings'])
+        self.registry.start()
+        for host in self.hosts.values():
+            if isinstance(host, VPN):
+                host.start()
+        if config['settings']['config_reload']:
+            FileWatcher(config_path, self.reload).start()
+        if config['settings']['metrics_listen']:
+            from host_monitor.exporter import start_exporter
+            start_exporter(self, config['settings']['metrics_listen'])
+        if config['settings']['state_socket']:
+            from host_monitor.broadcast import start_state_server
+            start_state_server(self, config['settings']['state_socket'])
+
+    def reload(self):
+        try:
+            new_config = load_config()
+        except Exception as e:
+            print(f"Invalid config {config_path}, keeping the current one: {e}", file=sys.stderr)
+            return False
+        with self.lock:
+            self.apply(new_config)
+        events.hosts_changed.emit(self)
+        return True
+
+    def apply(self, new_config):
+        # starts, stops or updates only the hosts that changed, the others keep running with their state
+        config.update(new_config)
+
+        old_ids = {}  # host key -> ids of the hosts with that key, in config order (names may repeat in groups)
+        for group in self.groups:
+            for host_id in group:
+                old_ids.setdefault(host_key(self.definitions[host_id]), []).append(host_id)
+        hosts = {}
+        definitions = {}
+        groups = []
+        created = []
+        changed = 0
+
+        for group_id, host_group in enumerate(config['groups']):
+            group = []
+            groups.append(group)
+
+            for definition in host_group['hosts']:
+                ids = old_ids.get(host_key(definition))
+                old_id = None
+                if ids:  # the host of the same group, if any
+                    old_id = next((host_id for host_id in ids if host_id[0] == group_id), ids[0])
+                    ids.remove(old_id)
+                host = self.hosts[old_id] if old_id else None
+                if host and not self.update_host(host, self.definitions[old_id], definition):
+                    self.stop_host(host)
+                    host = None
+                if host is None:
+                    host = self.create_host(group_id, definition)
+                    created.append(host)
+                elif self.definitions[old_id] != definition:
+                    changed += 1
+                host.id = (group_id, host.id[1])
+                group.append(host.id)
+                hosts[host.id] = host
+                definitions[host.id] = definition
+
+        stopped = [old_id for ids in old_ids.values() for old_id in ids]
+        for old_id in stopped:
+            self.stop_host(self.hosts[old_id])
+
+        # replaced, not updated, so that other threads can keep iterating the previous version
+        self.hosts = hosts
+        self.definitions = definitions
+        self.groups = groups
+        self.registry.index(hosts)
+        self.dependencies.link(self)
+
+        if self.started:
+            for host in created:
+                if isinstance(host, VPN):
+                    host.start()
+        for host in hosts.values():
+            if isinstance(host, VPN) and host not in created:
+                host.relink()
+
+        if args.verbose:
+            print(f"Config reloaded: {len(created)} hosts started, {len(stopped)} stopped, {changed} updated")
+
+    @staticmethod
+    def update_host(host, old_definition, definition):
+        # applies a changed definition to a running host, returns False if it has to be recreated
+        if old_definition == definition:
+            return True
+        if isinstance(host, VPN):
+            host.exclude_ips = definition['exclude_ips']
+            host.vpn_ip = definition['assigned_ip']
+            host.ping_ip = definition['ping_ip']
+            host.connect = definition['connect']
+            host.disconnect = definition['disconnect']
+            host.depends_on = definition.get('depends_on', 'INTERNET')
+            if definition['mode'] != old_definition['mode']:
+                host.mode = definition['mode']
+            return True
+        return probe_address(old_definition) == probe_address(definition)
+
+    def get_host(self, group=None, name=None, ip=None):
+        return self.registry.get(group, name, ip)
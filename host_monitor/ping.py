@@ -1,31 +1,48 @@
 import atexit
+import re
 import subprocess as sp
 import sys
 from threading import Lock
 
+from host_monitor.profiler import timer
+
 atexit_lock = Lock()
+rtt_pattern = re.compile(r"time[=<]\s*([\d.]+)", re.IGNORECASE)
+
+
+def parse_rtt(line):
+    match = rtt_pattern.search(line)
+    return float(match.group(1)) if match else None
 
 
 class PingLinux(object):
     def __init__(self, host):
-        with atexit_lock:
-            atexit.register(self.terminate)
         self.process = sp.Popen("ping -n -W 1 -s 1 -O {}".format(host).split(), stdout=sp.PIPE, stderr=sp.PIPE,
                                 encoding='utf8')
+        with atexit_lock:
+            atexit.register(self.terminate)
 
     def read(self):
         while True:
-            line = self.process.stdout.readline().strip()
-            if "ttl" in line:
-                return True
-            else:
-                return False
+            line = self.process.stdout.readline()
+            if not line:
+                raise EOFError(f"ping exited with code {self.process.wait()}")
+            with timer('ping.parse'):
+                line = line.strip()
+                if "ttl" in line:
+                    return True, parse_rtt(line)
+                else:
+                    return False, None
 
     def terminate(self):
-        self.process.terminate()
+        atexit.unregister(self.terminate)
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
 
     def __del__(self):
-        self.terminate()
+        if hasattr(self, 'process'):  # Popen may have failed
+            self.terminate()
 
 
 class PingWindows(object):
@@ -39,15 +56,22 @@ class PingWindows(object):
 
     def read(self):
         while True:
-            line = self.process.stdout.readline().strip()
+            line = self.process.stdout.readline()
+            if not line:
+                raise EOFError(f"ping exited with code {self.process.wait()}")
+            line = line.strip()
             # if args.verbose: print(line)
-            if "TTL" in line:
-                return True
-            else:
-                return False
+            with timer('ping.parse'):
+                if "TTL" in line:
+                    return True, parse_rtt(line)
+                else:
+                    return False, None
 
     def terminate(self):
-        self.process.terminate()
+        atexit.unregister(self.terminate)
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
 
 
 if sys.platform == "win32":
@@ -0,0 +1,139 @@
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from threading import Thread, Lock
+from time import perf_counter, sleep, monotonic
+
+from host_monitor.config import args
+
+enabled = args.profile
+
+stats_lock = Lock()
+stats = {}  # name -> [count, total, max] since the last summary
+
+
+def record(name, value):
+    # adds a duration (seconds) or any other value (queue depth, ... named *.depth, *.count) to the statistics of name
+    if not enabled:
+        return
+    with stats_lock:
+        stat = stats.get(name)
+        if stat is None:
+            stats[name] = [1, value, value]
+        else:
+            stat[0] += 1
+            stat[1] += value
+            if value > stat[2]:
+                stat[2] = value
+
+
+class Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        record(self.name, perf_counter() - self.start)
+
+
+null_timer = nullcontext()
+
+
+def timer(name):
+    # with timer('icmp.receive'): ... records its duration; a shared no-op context when profiling is off
+    return Timer(name) if enabled else null_timer
+
+
+def thread_cpu_times():
+    # thread name -> user + system CPU seconds, from /proc (Linux only)
+    times = {}
+    for thread in threading.enumerate():
+        try:
+            with open(f"/proc/self/task/{thread.native_id}/stat") as file:
+                fields = file.read().rpartition(')')[2].split()
+        except (OSError, AttributeError, TypeError):
+            continue
+        times[thread.name] = times.get(thread.name, 0) + (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return times
+
+
+class Profiler(Thread):
+    # Prints statistics of the timers and values recorded since the previous summary and the CPU time of
+    # each thread every interval seconds. With output, also samples the stacks of all threads and keeps
+    # them in that file in folded format ("frame;frame;frame count" lines, for flamegraph.pl or speedscope).
+    sample_interval = 0.01
+
+    def __init__(self, interval, output=None):
+        super(Profiler, self).__init__(name='profiler')
+        self.daemon = True
+        self.interval = interval
+        self.output = output
+        self.samples = Counter()
+        self.cpu_times = thread_cpu_times()
+
+    def run(self):
+        next_summary = monotonic() + self.interval
+        while True:
+            if self.output:
+                self.sample()
+                sleep(self.sample_interval)
+            else:
+                sleep(max(next_summary - monotonic(), 0))
+            if monotonic() >= next_summary:
+                self.summary()
+                if self.output:
+                    self.write()
+                next_summary += self.interval
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        with open(self.output + '.tmp', 'w') as file:
+            for stack, count in self.samples.items():
+                file.write(f"{stack} {count}\n")
+        os.replace(self.output + '.tmp', self.output)
+
+    def summary(self):
+        global stats
+        with stats_lock:
+            current, stats = stats, {}
+        lines = [f"--- profile of the last {self.interval:g} s"]
+        for name in sorted(current):
+            count, total, maximum = current[name]
+            if name.endswith('.depth'):
+                lines.append(f"{name:32} {count:8d}x  avg {total / count:10.1f}    max {maximum:10.1f}")
+            elif name.endswith('.count'):
+                lines.append(f"{name:32} {count:8d}x  avg {total / count:10.1f}    max {maximum:10.0f}"
+                             f"    total {total:7.0f}")
+            else:
+                lines.append(f"{name:32} {count:8d}x  avg {total / count * 1000:8.3f} ms  max {maximum * 1000:8.3f} ms"
+                             f"  total {total:7.3f} s")
+        cpu_times = thread_cpu_times()
+        for name, cpu_time in sorted(cpu_times.items(), key=lambda item: -item[1]):
+            used = cpu_time - self.cpu_times.get(name, 0)
+            if used > 0:
+                lines.append(f"thread {name:25} cpu {used / self.interval:7.1%}")
+        self.cpu_times = cpu_times
+        print('\n'.join(lines), file=sys.stderr, flush=True)
+
+
+def start_profiler():
+    if enabled:
+        Profiler(args.profile_interval, args.profile_output).start()
@@ -0,0 +1,71 @@
+from threading import Lock
+
+from host_monitor.history import get_store
+from host_monitor.host import Probe, VPN
+
+
+class Registry(object):
+    # Hosts indexed by id, name and address, and one shared probe per unique address:
+    # packets and ping processes grow with the number of targets, not with the number of config entries.
+    def __init__(self):
+        self.lock = Lock()
+        self.started = False
+        self.probes = {}  # address -> Probe
+        self.hosts = {}  # id -> host or VPN
+        self.names = {}  # name -> first host (in config order) with that name
+        self.addresses = {}  # address -> first host with that address
+
+    def probe(self, address):
+        # the probe of address, created (and started) on first use; release() it when no longer needed
+        with self.lock:
+            probe = self.probes.get(address)
+            created = probe is None
+            if created:
+                probe = self.probes[address] = Probe(address)
+                history_store = get_store()
+                if history_store:
+                    history_store.attach(probe)
+            probe.users += 1
+            start = created and self.started
+        if start:
+            probe.start()
+        return probe
+
+    def release(self, probe):
+        with self.lock:
+            probe.users -= 1
+            if probe.users > 0 or self.probes.get(probe.address) is not probe:
+                return
+            del self.probes[probe.address]
+        probe.stop()
+        history_store = get_store()
+        if history_store:
+            history_store.detach(probe)
+
+    def start(self):
+        with self.lock:
+            self.started = True
+            probes = list(self.probes.values())
+        for probe in probes:
+            probe.start()
+
+    def index(self, hosts):
+        names = {}
+        addresses = {}
+        for host_id, host in hosts.items():
+            names.setdefault(host_id[1], host)
+            if not isinstance(host, VPN):
+                addresses.setdefault(host.address, host)
+        # replaced, not updated, so that lookups on other threads never see a partial index
+        self.hosts, self.names, self.addresses = hosts, names, addresses
+
+    def get(self, group=None, name=None, ip=None):
+        if group is not None and name:
+            host = self.hosts.get((group, name))
+            if host:
+                return host
+        if name and name in self.names:
+            return self.names[name]
+        if ip:
+            return self.addresses.get(ip)
+        return None
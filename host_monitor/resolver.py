@@ -0,0 +1,337 @@
+import random
+import select
+import socket
+import struct
+from heapq import heappush, heappop
+from threading import Thread, Lock, Event
+from time import monotonic
+
+TYPE_A = 1
+TYPE_SOA = 6
+CLASS_IN = 1
+RCODE_NXDOMAIN = 3
+
+dns_header = struct.Struct('!HHHHHH')  # id, flags, questions, answers, authority, additional
+dns_record = struct.Struct('!HHIH')  # type, class, ttl, data length
+
+resolver_lock = Lock()
+resolver = None
+
+
+class ResolveError(OSError):
+    pass
+
+
+def read_resolv_conf(path='/etc/resolv.conf'):
+    # returns (nameservers, search domains, ndots)
+    nameservers = []
+    search = []
+    ndots = 1
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split('#')[0].split()
+                if len(fields) < 2:
+                    continue
+                if fields[0] == 'nameserver' and '.' in fields[1]:
+                    nameservers.append((fields[1], 53))
+                elif fields[0] == 'domain':
+                    search = fields[1:2]
+                elif fields[0] == 'search':
+                    search = fields[1:]
+                elif fields[0] == 'options':
+                    for option in fields[1:]:
+                        if option.startswith('ndots:') and option[6:].isdigit():
+                            ndots = int(option[6:])
+    except OSError:
+        pass
+    return nameservers, [domain.lower().rstrip('.') for domain in search], ndots
+
+
+def read_hosts(path='/etc/hosts'):
+    hosts = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split('#')[0].split()
+                if len(fields) >= 2 and '.' in fields[0] and ':' not in fields[0]:
+                    for name in fields[1:]:
+                        hosts.setdefault(name.lower(), []).append(fields[0])
+    except OSError:
+        pass
+    return {name: tuple(ips) for name, ips in hosts.items()}
+
+
+def build_query(query_id, name):
+    question = b''.join(bytes([len(label)]) + label.encode('idna') for label in name.rstrip('.').split('.'))
+    return dns_header.pack(query_id, 0x0100, 1, 0, 0, 0) + question + b'\0' + struct.pack('!HH', TYPE_A, CLASS_IN)
+
+
+def skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length & 0xc0 == 0xc0:  # compression pointer
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+def parse_response(data):
+    # returns (query id, rcode, ips, ttl); ttl of a negative answer is taken from the SOA record
+    query_id, flags, questions, answers, authority, _ = dns_header.unpack_from(data)
+    offset = dns_header.size
+    for _ in range(questions):
+        offset = skip_name(data, offset) + 4
+    ips = []
+    ttl = None
+    for index in range(answers + authority):
+        offset = skip_name(data, offset)
+        type, klass, record_ttl, length = dns_record.unpack_from(data, offset)
+        offset += dns_record.size
+        if index < answers and type == TYPE_A and klass == CLASS_IN and length == 4:
+            ips.append(socket.inet_ntoa(data[offset:offset + 4]))
+            ttl = record_ttl if ttl is None else min(ttl, record_ttl)
+        elif index >= answers and type == TYPE_SOA and not ips:
+            minimum = struct.unpack_from('!I', data, offset + length - 4)[0]
+            ttl = min(record_ttl, minimum)
+        offset += length
+    return query_id, flags & 0x0f, tuple(ips), ttl
+
+
+class Query(object):
+    def __init__(self, name, candidates):
+        self.name = name
+        self.candidates = candidates  # names queried in turn, with the search domains
+        self.candidate = 0
+        self.id = random.getrandbits(16)
+        self.server = None  # nameserver the query was sent to, only its responses are accepted
+        self.attempt = 0
+        self.deadline = None
+        self.callbacks = []
+
+
+class Resolver(Thread):
+    # Asynchronous A record resolver shared by all hosts:
+    #  * answers (and failures, for negative_ttl seconds) are cached for their TTL,
+    #  * concurrent lookups of one name share a single query,
+    #  * watched names are re-resolved in the background whenever their TTL expires.
+    # Names of /etc/hosts are answered from it, others are queried with the search domains of /etc/resolv.conf
+    # like the system resolver does. Names the nameservers do not know (e.g. mDNS or other nsswitch sources),
+    # or all names without nameservers in /etc/resolv.conf (e.g. on Windows), are resolved by getaddrinfo in a
+    # worker thread.
+    timeout = 2  # seconds to wait for a single answer
+    attempts = 3  # queries sent (to the next nameserver each time) before giving up
+    min_ttl = 5
+    max_ttl = 24 * 3600
+    negative_ttl = 30  # cache time of names that do not exist
+    error_ttl = 10  # cache time after a timeout
+    fallback_ttl = 300  # cache time of getaddrinfo results
+
+    def __init__(self, nameservers=None, hosts=None):
+        super(Resolver, self).__init__(name='resolver')
+        self.daemon = True
+        resolv_conf = read_resolv_conf()
+        self.nameservers = resolv_conf[0] if nameservers is None else nameservers
+        self.search, self.ndots = resolv_conf[1:]
+        self.hosts = read_hosts() if hosts is None else hosts
+        self.lock = Lock()
+        self.cache = {}  # name -> (ips or None, error, expiry time)
+        self.queries = {}  # name -> Query in flight
+        self.by_id = {}  # query id -> Query
+        self.watched = {}  # name -> callbacks
+        self.expiries = []  # heap of (expiry time, name) of watched names
+        self.sockets = {}
+        for family in {socket.AF_INET6 if ':' in server else socket.AF_INET for server, _ in self.nameservers}:
+            self.sockets[family] = socket.socket(family, socket.SOCK_DGRAM)
+            self.sockets[family].setblocking(False)
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+
+    def resolve(self, name, callback):
+        # callback(name, ips, error) is called once, on the resolver thread or immediately from the cache
+        name = name.lower().rstrip('.')
+        with self.lock:
+            cached = self.cache.get(name)
+            if cached and cached[2] > monotonic():
+                result = cached
+            else:
+                result = None
+                query = self.queries.get(name)
+                if query is None:
+                    query = self.queries[name] = Query(name, self.candidates(name))
+                    query.deadline = 0  # send on the resolver thread
+                query.callbacks.append(callback)
+        if result:
+            callback(name, result[0], result[1])
+        else:
+            self.wakeup_send.send(b'\0')
+
+    def lookup(self, name, timeout=None):
+        # blocking variant: returns the ips or raises ResolveError
+        done = Event()
+        results = []
+        self.resolve(name, lambda name, ips, error: (results.append((ips, error)), done.set()))
+        if not done.wait(timeout):
+            raise ResolveError(f"{name}: timed out")
+        ips, error = results[0]
+        if error:
+            raise error
+        return ips
+
+    def watch(self, name, callback):
+        # callback(name, ips, error) is called with the first result and whenever the TTL expires
+        name = name.lower().rstrip('.')
+        with self.lock:
+            self.watched.setdefault(name, []).append(callback)
+            cached = self.cache.get(name)
+            if cached:  # otherwise the expiry is scheduled when the query finishes
+                heappush(self.expiries, (cached[2], name))
+        self.wakeup_send.send(b'\0')
+        self.resolve(name, callback)
+
+    def unwatch(self, name, callback):
+        name = name.lower().rstrip('.')
+        with self.lock:
+            callbacks = self.watched.get(name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.watched.pop(name, None)
+
+    def finish(self, query, ips, error, ttl):
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        expiry = monotonic() + ttl
+        with self.lock:
+            self.cache[query.name] = (ips, error, expiry)
+            self.queries.pop(query.name, None)
+            self.by_id.pop(query.id, None)
+            callbacks = list(query.callbacks)
+            if query.name in self.watched:
+                heappush(self.expiries, (expiry, query.name))
+        for callback in callbacks:
+            callback(query.name, ips, error)
+
+    def refresh(self, name):
+        with self.lock:
+            if name not in self.watched or name in self.queries:
+                return
+            query = self.queries[name] = Query(name, self.candidates(name))
+            query.deadline = 0
+            query.callbacks.extend(self.watched[name])
+
+    def candidates(self, name):
+        # names with at least ndots dots are tried as they are first, others with the search domains first
+        searched = [f"{name}.{domain}" for domain in self.search]
+        return [name] + searched if name.count('.') >= self.ndots else searched + [name]
+
+    def send(self, query, now):
+        if query.name in self.hosts:
+            return self.finish(query, self.hosts[query.name], None, self.max_ttl)
+        if not self.nameservers or query.attempt >= self.attempts:
+            return self.resolve_fallback(query)
+        server = self.nameservers[query.attempt % len(self.nameservers)]
+        query.attempt += 1
+        query.deadline = now + self.timeout
+        query.server = server
+        with self.lock:
+            self.by_id[query.id] = query
+        family = socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+        try:
+            self.sockets[family].sendto(build_query(query.id, query.candidates[query.candidate]), server)
+        except (OSError, UnicodeError) as e:
+            self.finish(query, None, ResolveError(f"{query.name}: {e}"), self.error_ttl)
+
+    def next_candidate(self, query):
+        # the name is not known with this search domain: query the next one, or fall back to getaddrinfo
+        with self.lock:
+            self.by_id.pop(query.id, None)
+        query.candidate += 1
+        if query.candidate >= len(query.candidates):
+            return self.resolve_fallback(query)
+        query.id = random.getrandbits(16)
+        query.attempt = 0
+        query.deadline = 0
+
+    def resolve_fallback(self, query):
+        with self.lock:
+            self.by_id.pop(query.id, None)
+        query.deadline = None
+        Thread(target=self.resolve_system, args=(query,), daemon=True).start()
+
+    def resolve_system(self, query):
+        try:
+            infos = socket.getaddrinfo(query.name, None, socket.AF_INET, socket.SOCK_DGRAM)
+            ips = tuple(dict.fromkeys(info[4][0] for info in infos))
+            self.finish(query, ips, None, self.fallback_ttl)
+        except OSError as e:
+            self.finish(query, None, ResolveError(f"{query.name}: {e}"), self.negative_ttl)
+
+    def receive(self, sock):
+        while True:
+            try:
+                data, server = sock.recvfrom(4096)
+            except OSError:
+                return
+            try:
+                query_id, rcode, ips, ttl = parse_response(data)
+            except (struct.error, IndexError):
+                continue
+            with self.lock:
+                query = self.by_id.get(query_id)
+            if query is None or server[:2] != query.server:  # late, or not from the nameserver asked
+                continue
+            if ips:
+                self.finish(query, ips, None, ttl)
+            elif rcode in (0, RCODE_NXDOMAIN):
+                self.next_candidate(query)
+            else:
+                query.deadline = 0  # server failure: try the next nameserver
+
+    def run(self):
+        while True:
+            now = monotonic()
+            deadline = now + 60
+            expired = []
+            with self.lock:
+                while self.expiries and self.expiries[0][0] <= now:
+                    expired.append(heappop(self.expiries)[1])
+                if self.expiries:
+                    deadline = min(deadline, self.expiries[0][0])
+            for name in expired:
+                self.refresh(name)
+            with self.lock:
+                queries = list(self.queries.values())
+            for query in queries:
+                if query.deadline is not None and query.deadline <= now:
+                    self.send(query, now)
+                if query.deadline is not None:
+                    deadline = min(deadline, query.deadline)
+
+            readable, _, _ = select.select([self.wakeup_recv] + list(self.sockets.values()), [], [],
+                                           max(deadline - monotonic(), 0))
+            for sock in readable:
+                if sock is self.wakeup_recv:
+                    try:
+                        sock.recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    self.receive(sock)
+
+
+def is_ip_address(address):
+    try:
+        socket.inet_aton(address)
+        return address.count('.') == 3
+    except OSError:
+        return False
+
+
+def get_resolver():
+    global resolver
+    with resolver_lock:
+        if resolver is None:
+            resolver = Resolver()
+            resolver.start()
+        return resolver
@@ -0,0 +1,144 @@
+import itertools
+from heapq import heappush, heappop
+from multiprocessing import parent_process
+from threading import Lock
+from time import monotonic
+
+from host_monitor.config import config
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, tokens=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst if tokens is None else tokens  # more than burst once, e.g. at startup
+        self.time = monotonic()
+
+    def refill(self, now):
+        if self.tokens < self.burst:
+            self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        self.refill(now)
+        return max(1 - self.tokens, 0) / self.rate
+
+
+class Scheduler(object):
+    # Owns probe timing of all hosts:
+    #  * new hosts are probed every probe_interval seconds,
+    #  * right after a state change a host is probed every probe_min_interval seconds,
+    #  * after probe_backoff_time seconds of stable state it is probed every probe_interval seconds,
+    #  * the interval doubles with every further probe_backoff_time seconds, up to probe_max_interval,
+    #  * each host has its own bucket (never faster than probe_min_interval),
+    #  * all hosts share a global bucket of probe_rate_limit packets/second; when it runs dry hosts
+    #    wait in order of their due time, so the most overdue host is always served first,
+    #  * the global bucket starts with probe_startup_burst packets, so that every host gets its first
+    #    status at once after startup,
+    #  * hosts that cannot be probed (send errors) are retried with exponential backoff.
+    # In a probe worker process (probe_workers) the global bucket is the worker's share of it.
+    error_max_delay = 60
+
+    def __init__(self):
+        settings = config['settings']
+        self.base_interval = settings['probe_interval']
+        self.min_interval = settings['probe_min_interval']
+        self.max_interval = settings['probe_max_interval']
+        self.backoff_time = settings['probe_backoff_time']
+        workers = settings['probe_workers'] if settings['probe_workers'] and parent_process() else 1
+        rate = settings['probe_rate_limit'] / workers
+        burst = max(1, rate * settings['probe_burst_time'])
+        self.bucket = TokenBucket(rate, burst, max(burst, settings['probe_startup_burst'] / workers))
+        self.lock = Lock()
+        self.queue = []  # heap of (due time, order, host)
+        self.order = itertools.count()
+        self.hosts = {}  # host -> [due time, bucket, time of the last state change, consecutive errors]
+
+    def add(self, host, due):
+        now = monotonic()
+        with self.lock:
+            # stable since probe_backoff_time: probe_interval, not probe_min_interval until its state changes
+            self.hosts[host] = [due, TokenBucket(1 / self.min_interval, 1), now - self.backoff_time, 0]
+            host.interval = self.base_interval
+            heappush(self.queue, (due, next(self.order), host))
+
+    def remove(self, host):
+        with self.lock:
+            self.hosts.pop(host, None)
+
+    def interval(self, stable_time):
+        if stable_time < self.backoff_time:
+            return self.min_interval
+        doublings = int(stable_time // self.backoff_time) - 1
+        return min(self.base_interval * 2 ** min(doublings, 32), self.max_interval)
+
+    def changed(self, host):
+        # probe again soon to confirm the new state
+        now = monotonic()
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is None:
+                return
+            entry[2] = now
+            host.interval = self.min_interval
+            due = now + self.min_interval
+            if due < entry[0]:
+                entry[0] = due
+                heappush(self.queue, (due, next(self.order), host))
+
+    def failed(self, host):
+        now = monotonic()
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is None:
+                return
+            entry[3] += 1
+            entry[0] = now + min(self.base_interval * 2 ** min(entry[3] - 1, 32), self.error_max_delay)
+            host.interval = entry[0] - now
+            heappush(self.queue, (entry[0], next(self.order), host))
+
+    def succeeded(self, host):
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is not None:
+                entry[3] = 0
+
+    def due(self, now):
+        due = []
+        with self.lock:
+            while self.queue and self.queue[0][0] <= now:
+                due_time, order, host = self.queue[0]
+                entry = self.hosts.get(host)
+                if entry is None or entry[0] != due_time:  # removed or rescheduled
+                    heappop(self.queue)
+                    continue
+                if not entry[1].take(now):
+                    heappop(self.queue)
+                    entry[0] = now + entry[1].wait_time(now)
+                    heappush(self.queue, (entry[0], order, host))
+                    continue
+                if not self.bucket.take(now):
+                    entry[1].tokens += 1  # not sent, the host keeps its place in the queue
+                    break
+                heappop(self.queue)
+                host.interval = self.interval(now - entry[2])
+                entry[0] = max(due_time + host.interval, now)
+                heappush(self.queue, (entry[0], order, host))
+                due.append(host)
+        return due
+
+    def next_deadline(self, now):
+        with self.lock:
+            if not self.queue:
+                return None
+            deadline = self.queue[0][0]
+            if deadline <= now:
+                return now + self.bucket.wait_time(now)
+            return deadline
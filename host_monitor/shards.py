@@ -0,0 +1,319 @@
+import atexit
+import itertools
+import math
+import signal
+import struct
+import sys
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from threading import Thread, Lock
+from time import monotonic
+
+from host_monitor.config import args
+from host_monitor.history import statuses
+from host_monitor.host import Probe, PROBE_ERROR
+
+NAN = float('nan')
+
+ring_header = struct.Struct('<QQQ')  # records written (by the worker), records read (by the main process), dropped
+ring_record = struct.Struct('<IB3xd')  # probe slot, status, rtt (ms, NaN = none)
+ring_states = {status: state for state, status in statuses.items()}
+
+
+class Ring(object):
+    # Queue of probe updates in shared memory: the worker only writes records and the written counter, the main
+    # process only the read counter. The probes of a worker put from several threads (the engine, resolver
+    # callbacks, ping subprocesses), so puts are serialized by a lock. When full, updates are dropped.
+    def __init__(self, capacity, name=None):
+        from multiprocessing.shared_memory import SharedMemory
+        self.capacity = capacity
+        self.memory = SharedMemory(name, create=name is None, size=ring_header.size + capacity * ring_record.size)
+        self.buffer = self.memory.buf
+        self.lock = Lock()  # producers of this process
+
+    def put(self, slot, status, rtt):
+        with self.lock:
+            written, read, dropped = ring_header.unpack_from(self.buffer)
+            if written - read >= self.capacity:
+                struct.pack_into('<Q', self.buffer, 16, dropped + 1)
+                return
+            ring_record.pack_into(self.buffer, ring_header.size + written % self.capacity * ring_record.size,
+                                  slot, status, rtt)
+            struct.pack_into('<Q', self.buffer, 0, written + 1)
+
+    def get(self):
+        written, read, _ = ring_header.unpack_from(self.buffer)
+        if written == read:
+            return ()
+        start = read % self.capacity
+        end = start + (written - read)
+        records = ring_header.size + start * ring_record.size
+        if end <= self.capacity:
+            chunks = [self.buffer[records:records + (end - start) * ring_record.size]]
+        else:
+            chunks = [self.buffer[records:],
+                      self.buffer[ring_header.size:ring_header.size + (end - self.capacity) * ring_record.size]]
+        updates = [record for chunk in chunks for record in ring_record.iter_unpack(chunk)]
+        for chunk in chunks:
+            chunk.release()
+        struct.pack_into('<Q', self.buffer, 8, written)
+        return updates
+
+    @property
+    def dropped(self):
+        return ring_header.unpack_from(self.buffer)[2]
+
+    def close(self, unlink=False):
+        self.buffer.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class RemoteProbe(Probe):
+    # probe in a worker process: its updates go to the ring of the worker instead of statistics and observers
+    def __init__(self, slot, address, ring, worker):
+        super(RemoteProbe, self).__init__(address)
+        self.rtt = None
+        self.slot = slot
+        self.ring = ring
+        self.worker = worker
+        self.address_changed.subscribe(lambda probe: worker.send(('resolved', slot, self.resolved_address)))
+
+    def update_state(self, ping_success, rtt):
+        self.ring.put(self.slot, statuses[ping_success], NAN if rtt is None else rtt)
+        if ping_success != self.state:
+            first = self.state is None
+            self.state = ping_success
+            return not first
+        return False
+
+
+class Worker(object):
+    # probe loop of one worker process, targets are added and removed by messages of the main process
+    def __init__(self, ring_name, capacity, commands, messages):
+        self.ring = Ring(capacity, ring_name)
+        self.commands = commands
+        self.messages = messages
+        self.send_lock = Lock()
+        self.probes = {}  # slot -> RemoteProbe
+
+    def send(self, message):
+        with self.send_lock:
+            self.messages.send(message)
+
+    def run(self):
+        while True:
+            try:
+                command, slot, address = self.commands.recv()
+            except (EOFError, OSError):  # main process exited
+                return
+            if command == 'add':
+                probe = self.probes[slot] = RemoteProbe(slot, address, self.ring, self)
+                probe.start()
+            elif command == 'remove':
+                probe = self.probes.pop(slot, None)
+                if probe:
+                    probe.stop()
+
+
+def run_worker(ring_name, capacity, commands, messages):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the main process
+    Worker(ring_name, capacity, commands, messages).run()
+
+
+class Shard(object):
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.control = None  # commands to the worker
+        self.messages = None  # messages from the worker, a separate pipe so that neither side blocks the other
+        self.ring = None
+        self.slots = set()
+        self.started = 0
+        self.restart_delay = ShardedEngine.restart_min_delay
+        self.restart_time = None  # set while the worker is down
+
+
+class ShardedEngine(Thread):
+    # Replaces the probe engine with probe_workers processes (probe_workers > 0), each running its own engine
+    # on a share of the targets. Updates come back through one shared-memory Ring per worker, drained every
+    # poll_interval seconds, so there is no pickling per ping. New targets go to the least loaded worker and
+    # every rebalance_interval seconds targets are moved when worker loads differ by more than 10%. Targets
+    # of a crashed worker are moved to the others at once and the worker is restarted with exponential backoff.
+    poll_interval = 0.02
+    rebalance_interval = 10
+    ring_capacity = 65536
+    restart_min_delay = 1
+    restart_max_delay = 60
+    restart_reset_time = 60  # workers running this long are restarted with the minimal delay
+
+    def __init__(self, workers):
+        super(ShardedEngine, self).__init__(name='shards')
+        self.daemon = True
+        self.context = get_context('spawn')  # the main process runs threads (and Qt), fork is not safe
+        self.lock = Lock()
+        self.probes = {}  # slot -> probe
+        self.slot_of = {}  # probe -> slot
+        self.shard_of = {}  # slot -> shard
+        self.slots = itertools.count()  # slots are never reused, late updates of removed probes are ignored
+        self.shards = [Shard(index) for index in range(workers)]
+        self.closed = False
+        for shard in self.shards:
+            self.start_worker(shard)
+        atexit.register(self.close)
+
+    def start_worker(self, shard):
+        shard.ring = Ring(self.ring_capacity)
+        commands, control = self.context.Pipe(duplex=False)
+        messages, worker_messages = self.context.Pipe(duplex=False)
+        shard.process = self.context.Process(target=run_worker, name=f"probe worker {shard.index}", daemon=True,
+                                             args=(shard.ring.memory.name, self.ring_capacity, commands,
+                                                   worker_messages))
+        shard.process.start()
+        commands.close()
+        worker_messages.close()
+        shard.control = control
+        shard.messages = messages
+        shard.started = monotonic()
+        shard.restart_time = None
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        for shard in self.shards:
+            if shard.process.is_alive():
+                shard.process.kill()
+            shard.ring.close(unlink=True)
+
+    def send(self, shard, message):
+        try:
+            shard.control.send(message)
+        except (OSError, ValueError):  # worker died, its targets are moved when that is noticed
+            pass
+
+    def assign(self, slot, shard):
+        self.shard_of[slot] = shard
+        shard.slots.add(slot)
+        self.send(shard, ('add', slot, self.probes[slot].address))
+
+    def unassign(self, slot):
+        shard = self.shard_of.pop(slot)
+        shard.slots.discard(slot)
+        self.send(shard, ('remove', slot, None))
+
+    def running_shards(self):
+        return [shard for shard in self.shards if shard.restart_time is None] or self.shards
+
+    def add(self, probe):
+        with self.lock:
+            slot = next(self.slots)
+            self.probes[slot] = probe
+            self.slot_of[probe] = slot
+            self.assign(slot, min(self.running_shards(), key=lambda shard: len(shard.slots)))
+
+    def remove(self, probe):
+        with self.lock:
+            slot = self.slot_of.pop(probe, None)
+            if slot is None:
+                return
+            self.unassign(slot)
+            del self.probes[slot]
+
+    def drain(self, shard, updates):
+        # collects the updates of shard, applied after the lock is released: their observers may add and remove
+        # probes (see Dependencies)
+        for slot, status, rtt in shard.ring.get():
+            probe = self.probes.get(slot)
+            if probe is None or self.shard_of.get(slot) is not shard:
+                continue
+            state = ring_states[status]
+            if state == PROBE_ERROR:
+                probe.probe_errors += 1
+            updates.append((probe, state, None if rtt != rtt else rtt))
+
+    def receive(self, shard, resolved):
+        try:
+            while shard.messages.poll():
+                command, slot, value = shard.messages.recv()
+                probe = self.probes.get(slot)
+                if command == 'resolved' and probe:
+                    probe.resolved_address = value
+                    resolved.append(probe)
+        except (EOFError, OSError):
+            pass
+
+    def check_worker(self, shard, now, updates):
+        if shard.restart_time is None:
+            if shard.process.is_alive():
+                return
+            self.drain(shard, updates)
+            if now - shard.started > self.restart_reset_time:
+                shard.restart_delay = self.restart_min_delay
+            shard.restart_time = now + shard.restart_delay
+            print(f"Probe worker {shard.index} exited with code {shard.process.exitcode}, "
+                  f"restarting in {shard.restart_delay:g}s", file=sys.stderr)
+            shard.restart_delay = min(shard.restart_delay * 2, self.restart_max_delay)
+            shard.control.close()
+            shard.messages.close()
+            slots = list(shard.slots)
+            shard.slots.clear()
+            running = [other for other in self.shards if other.restart_time is None]
+            for slot in slots:
+                del self.shard_of[slot]
+                if running:
+                    self.assign(slot, min(running, key=lambda other: len(other.slots)))
+                else:  # kept for the restarted worker
+                    self.shard_of[slot] = shard
+                    shard.slots.add(slot)
+        elif now >= shard.restart_time:
+            shard.ring.close(unlink=True)
+            self.start_worker(shard)
+            for slot in shard.slots:
+                self.send(shard, ('add', slot, self.probes[slot].address))
+
+    def rebalance(self):
+        # moves the targets above the average load to the workers below it
+        running = self.running_shards()
+        loads = [len(shard.slots) for shard in running]
+        average = sum(loads) / len(running)
+        if max(loads) - min(loads) <= max(1, average * 0.1):
+            return
+        surplus = []
+        for shard in running:
+            surplus.extend(list(shard.slots)[:max(len(shard.slots) - math.ceil(average), 0)])
+        moved = 0
+        for shard in running:
+            while surplus and len(shard.slots) < int(average):
+                slot = surplus.pop()
+                self.unassign(slot)
+                self.assign(slot, shard)
+                moved += 1
+        if args.verbose:
+            print(f"Moved {moved} targets between probe workers, loads {[len(shard.slots) for shard in running]}")
+
+    def run(self):
+        next_rebalance = monotonic() + self.rebalance_interval
+        while True:
+            readable = wait([shard.messages for shard in self.shards if shard.restart_time is None] +
+                            [shard.process.sentinel for shard in self.shards if shard.restart_time is None],
+                            self.poll_interval)
+            now = monotonic()
+            updates = []
+            resolved = []
+            with self.lock:
+                if self.closed:
+                    return
+                for shard in self.shards:
+                    if shard.restart_time is None:
+                        if shard.messages in readable:
+                            self.receive(shard, resolved)
+                        self.drain(shard, updates)
+                    self.check_worker(shard, now, updates)
+                if now >= next_rebalance:
+                    self.rebalance()
+                    next_rebalance = now + self.rebalance_interval
+            for probe in resolved:
+                probe.address_changed.emit(probe)
+            for probe, state, rtt in updates:
+                probe.update(state, rtt)
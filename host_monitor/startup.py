@@ -0,0 +1,68 @@
+import sys
+from threading import Lock, Timer
+from time import perf_counter
+
+# checked before the arguments are parsed, so that parsing them and reading the config are timed too
+enabled = '--startup-timing' in sys.argv
+report_timeout = 60  # seconds, the report is printed then even if some hosts have no status yet
+
+start = perf_counter()
+last = start
+phases = []  # (phase, seconds since the previous phase)
+
+
+def phase(name):
+    # marks the end of a startup phase
+    global last
+    if not enabled:
+        return
+    now = perf_counter()
+    phases.append((name, now - last))
+    last = now
+
+
+def report(missing=0):
+    lines = ["--- startup timing"]
+    total = 0
+    for name, seconds in phases:
+        total += seconds
+        lines.append(f"{name:24} {seconds * 1000:9.1f} ms  {total * 1000:9.1f} ms")
+    if missing:
+        lines.append(f"{missing} hosts without status after {report_timeout} s")
+    print('\n'.join(lines), file=sys.stderr, flush=True)
+
+
+def watch(monitor):
+    # ends the startup with the first status of the first and of the last host (VPNs excepted)
+    if not enabled:
+        return
+    from host_monitor import events
+    pending = {host_id for host_id, host in monitor.hosts.items() if not host.is_vpn}
+    total = len(pending)
+    lock = Lock()
+
+    def state_changed(host, state):
+        with lock:
+            if host.id not in pending:
+                return
+            pending.discard(host.id)
+            if len(pending) == total - 1:
+                phase('first status')
+            if pending:
+                return
+            phase('all statuses')
+            events.state_changed.unsubscribe(state_changed)
+            timeout.cancel()
+        report()
+
+    def timed_out():
+        with lock:
+            events.state_changed.unsubscribe(state_changed)
+            missing = len(pending)
+        if missing:
+            report(missing)
+
+    timeout = Timer(report_timeout, timed_out)
+    timeout.daemon = True
+    timeout.start()
+    events.state_changed.subscribe(state_changed)
@@ -0,0 +1,107 @@
+import math
+from array import array
+from threading import Lock
+
+NAN = float('nan')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return NAN
+    k = (len(sorted_values) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+
+class RttBuffer(object):
+    # fixed-size ring of round-trip times in milliseconds, NaN = lost packet
+    def __init__(self, size):
+        self.size = size
+        self.rtts = array('d', [NAN]) * size
+        self.count = 0  # samples written since start
+        self.received = 0  # replies since start
+        self.total = 0.0  # sum of all round-trip times since start
+        self.lock = Lock()  # held only for writes and raw copies, never for computations
+
+    def add(self, rtt):
+        with self.lock:
+            self.rtts[self.count % self.size] = NAN if rtt is None else rtt
+            self.count += 1
+            if rtt is not None:
+                self.received += 1
+                self.total += rtt
+
+    def last(self):
+        if not self.count:
+            return None
+        rtt = self.rtts[(self.count - 1) % self.size]
+        return None if math.isnan(rtt) else rtt
+
+    def window(self, samples=None):
+        with self.lock:
+            return self.tail(min(samples or self.size, self.count, self.size))
+
+    def since(self, count):
+        # (samples written so far, the samples written after the first count of them, at most size)
+        with self.lock:
+            return self.count, self.tail(min(self.count - count, self.size))
+
+    def tail(self, n):
+        # the last n samples, called with the lock held
+        end = self.count % self.size
+        if n <= end:
+            return self.rtts[end - n:end]
+        return self.rtts[self.size - (n - end):] + self.rtts[:end]
+
+    def stats(self, samples=None):
+        window = self.window(samples)
+        received = [rtt for rtt in window if rtt == rtt]  # drop NaNs
+        stats = {'samples': len(window), 'loss': 1 - len(received) / len(window) if window else NAN}
+        if received:
+            jitter = sum(abs(b - a) for a, b in zip(received, received[1:])) / (len(received) - 1) \
+                if len(received) > 1 else 0.0
+            stats['avg'] = sum(received) / len(received)
+            stats['jitter'] = jitter
+            received.sort()
+            stats['min'] = received[0]
+            stats['max'] = received[-1]
+            for p in (50, 95, 99):
+                stats[f'p{p}'] = percentile(received, p)
+        else:
+            for key in ('avg', 'jitter', 'min', 'max', 'p50', 'p95', 'p99'):
+                stats[key] = NAN
+        return stats
+
+
+class LossWindow(object):
+    # lost pings among the last size pings, updated in O(1); pings not sent yet count as replies
+    def __init__(self, size):
+        self.size = size
+        self.lost = bytearray(size)
+        self.count = 0
+        self.losses = 0
+
+    def add(self, lost):
+        index = self.count % self.size
+        self.losses += lost - self.lost[index]
+        self.lost[index] = lost
+        self.count += 1
+
+    def clear(self):
+        self.lost[:] = bytes(self.size)
+        self.count = 0
+        self.losses = 0
+
+    @property
+    def ratio(self):
+        return self.losses / self.size
+
+
+def format_stats(stats):
+    if not stats['samples']:
+        return "no samples"
+    if stats['loss'] == 1:
+        return "no replies to {samples} pings".format(**stats)
+    return "rtt min/avg/p50/p95/p99 = {min:.1f}/{avg:.1f}/{p50:.1f}/{p95:.1f}/{p99:.1f} ms\n" \
+           "jitter {jitter:.1f} ms, loss {loss:.0%} of {samples} pings".format(**stats)
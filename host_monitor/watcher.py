@@ -0,0 +1,83 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from threading import Thread
+from time import sleep
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_CLOEXEC = 0o2000000
+
+inotify_event = struct.Struct('iIII')  # watch descriptor, mask, cookie, name length
+
+
+class FileWatcher(Thread):
+    # Calls callback() after the file is written or replaced. The directory is watched, so editors
+    # that save through a temporary file and rename it are noticed as well.
+    settle_time = 0.2  # editors often write in several steps
+    poll_interval = 2  # without inotify (not Linux) the modification time is polled
+
+    def __init__(self, path, callback):
+        super(FileWatcher, self).__init__(name='config-watcher')
+        self.daemon = True
+        self.path = os.path.realpath(path)
+        self.callback = callback
+
+    def run(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            directory, name = os.path.split(self.path)
+            mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+            if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        except (OSError, AttributeError, TypeError):
+            return self.poll()
+
+        while True:
+            data = os.read(fd, 65536)
+            if not self.concerns_file(data, name.encode()):
+                continue
+            # wait until the writes settle, dropping the events they cause
+            while select.select([fd], [], [], self.settle_time)[0]:
+                os.read(fd, 65536)
+            self.notify()
+
+    @staticmethod
+    def concerns_file(data, name):
+        offset = 0
+        while offset + inotify_event.size <= len(data):
+            _, _, _, length = inotify_event.unpack_from(data, offset)
+            offset += inotify_event.size
+            if data[offset:offset + length].rstrip(b'\0') == name:
+                return True
+            offset += length
+        return False
+
+    def poll(self):
+        def mtime():
+            try:
+                return os.stat(self.path).st_mtime
+            except OSError:
+                return None
+
+        last = mtime()
+        while True:
+            sleep(self.poll_interval)
+            current = mtime()
+            if current != last:
+                last = current
+                sleep(self.settle_time)
+                self.notify()
+
+    def notify(self):
+        try:
+            self.callback()
+        except Exception as e:
+            print(f"Reloading {self.path} failed: {e}")
@@ -37,6 +37,6 @@ setup(
     package_data={"host_monitor": data_files},
     entry_points={'gui_scripts': ['host-monitor=host_monitor.main:main']},
     license="GPL-3.0+",
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     install_requires=requirements,
 )
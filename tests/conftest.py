@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def home(tmp_path):
+    # a HOME with the config ~/.host-monitor, host-monitor runs in subprocesses: its config and arguments are
+    # read at import, also by the probe worker processes
+    def write(groups, **settings):
+        config = {'settings': {'probe_backend': 'fake', 'history_dir': '', 'config_reload': False, **settings},
+                  'groups': [{'hosts': hosts} for hosts in groups]}
+        with open(tmp_path / '.host-monitor', 'w') as file:
+            yaml.safe_dump(config, file)
+        return tmp_path
+    return write
+
+
+def run(home, args, timeout):
+    # output of host-monitor (or python -c) until it exits or is interrupted after timeout seconds
+    env = {**os.environ, 'HOME': str(home), 'PYTHONPATH': root, 'QT_QPA_PLATFORM': 'offscreen'}
+    process = subprocess.Popen([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True)
+    try:
+        return process.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        process.send_signal(2)  # SIGINT, a deadlocked process does not exit on it either
+        try:
+            return process.communicate(timeout=5)[0]
+        except subprocess.TimeoutExpired:
+            process.kill()
+            output = process.communicate()[0]
+            raise AssertionError(f"host-monitor hangs, output:\n{output}")
@@ -0,0 +1,32 @@
+import socket
+import struct
+
+from host_monitor.addresses import (LocalAddresses, nlmsghdr, ifaddrmsg, rtattr, RTM_NEWADDR, NLMSG_DONE,
+                                    IFA_LOCAL)
+
+
+def message(type, index=0, ip=None):
+    body = b''
+    if ip:
+        body = ifaddrmsg.pack(socket.AF_INET, 24, 0, 0, index) + rtattr.pack(8, IFA_LOCAL) + socket.inet_aton(ip)
+    return nlmsghdr.pack(nlmsghdr.size + len(body), type, 0, 1, 0) + body
+
+
+def test_resync_publishes_complete_dumps_only():
+    addresses = LocalAddresses()
+    published = []
+    addresses.changed.subscribe(published.append)
+    addresses.dump = set()
+    addresses.handle(message(RTM_NEWADDR, 1, '10.0.0.2') + message(RTM_NEWADDR, 2, '192.168.152.7'))
+    assert published == []
+    addresses.handle(message(NLMSG_DONE))
+    assert published == [frozenset({'10.0.0.2', '192.168.152.7'})]
+
+    addresses.dump = set()  # ENOBUFS: dumped again
+    addresses.handle(message(RTM_NEWADDR, 1, '10.0.0.2'))
+    assert addresses.get() == frozenset({'10.0.0.2', '192.168.152.7'})
+    addresses.handle(message(RTM_NEWADDR, 2, '192.168.152.7') + message(NLMSG_DONE))
+    assert len(published) == 1
+
+    addresses.handle(message(RTM_NEWADDR, 3, '10.9.0.1'))
+    assert published[-1] == frozenset({'10.0.0.2', '192.168.152.7', '10.9.0.1'})
@@ -0,0 +1,31 @@
+from conftest import run
+
+drop_script = '''
+import os
+from host_monitor import events
+from host_monitor.alerts import AlertPipeline, LogSink
+
+class Host(object):
+    def __init__(self, name):
+        self.id = (1, name)
+        self.is_vpn = False
+
+sink = LogSink({'path': os.path.expanduser('~/alerts.log')})
+pipeline = AlertPipeline([sink], 0, 1)
+events.state_changed.unsubscribe(pipeline.state_changed)
+pipeline.max_pending = 2
+pipeline.batch({(group, 'a'): [True, False] for group in range(5)})
+pipeline.queue.maxsize = 1
+pipeline.state_changed(Host('a'), False)
+pipeline.state_changed(Host('b'), False)
+print(pipeline.dropped, sink.dropped, pipeline.queue.get(), flush=True)
+pipeline.report_drops()
+print(pipeline.drops() == pipeline.reported)
+'''
+
+
+def test_dropped_alerts_are_reported(home):
+    output = run(home([]), ['-c', drop_script], timeout=20).splitlines()
+    assert output[-3:] == ["1 3 ((1, 'a'), 'down')",
+                           "Alerts dropped so far: 1 state changes (queue full), alerts 3 by LogSink (too many pending)",
+                           "True"]
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from conftest import run
+
+checks_script = '''
+import json
+from time import sleep, monotonic
+from host_monitor.host import Probe
+
+probes = {name: Probe(address) for name, address in %r.items()}
+for probe in probes.values():
+    probe.start()
+deadline = monotonic() + 5
+while any(probe.state is None for probe in probes.values()) and monotonic() < deadline:
+    sleep(0.05)
+print(json.dumps({name: probe.state for name, probe in probes.items()}))
+'''
+
+
+async def serve_http(reader, writer):
+    # GET /ok: 200, /hang: no response, anything else: 404; kept alive
+    try:
+        while True:
+            path = (await reader.readuntil(b'\r\n\r\n')).split()[1]
+            if path == b'/hang':
+                await asyncio.sleep(60)
+            status = b'200 OK' if path == b'/ok' else b'404 Not Found'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        writer.close()
+
+
+class Nameserver(asyncio.DatagramProtocol):
+    # answers every query with NOERROR and no records
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.transport.sendto(data[:2] + b'\x81\x80' + data[4:], address)
+
+
+@pytest.fixture
+def servers():
+    # an HTTP server (also the tcp target) and a nameserver on localhost, a refused and a silent port
+    loop = asyncio.new_event_loop()
+    http = loop.run_until_complete(asyncio.start_server(serve_http, '127.0.0.1', 0))
+    dns, _ = loop.run_until_complete(loop.create_datagram_endpoint(Nameserver, local_addr=('127.0.0.1', 0)))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        refused = closed.getsockname()[1]
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(('127.0.0.1', 0))
+    yield {'http': http.sockets[0].getsockname()[1], 'dns': dns.get_extra_info('sockname')[1], 'refused': refused,
+           'silent': silent.getsockname()[1]}
+    loop.call_soon_threadsafe(loop.stop)
+    silent.close()
+
+
+def test_checks(home, servers):
+    addresses = {
+        'tcp': f"tcp://127.0.0.1:{servers['http']}",
+        'http': f"http://127.0.0.1:{servers['http']}/ok",
+        'http status': f"http://127.0.0.1:{servers['http']}/missing",
+        'http timeout': f"http://127.0.0.1:{servers['http']}/hang#timeout=0.5",
+        'refused': f"tcp://127.0.0.1:{servers['refused']}",
+        'dns': f"dns://127.0.0.1:{servers['dns']}/example.com",
+        'dns timeout': f"dns://127.0.0.1:{servers['silent']}/example.com#timeout=0.5",
+    }
+    states = json.loads(run(home([]), ['-c', checks_script % addresses], timeout=20).splitlines()[-1])
+    assert states == {'tcp': True, 'http': True, 'http status': False, 'http timeout': False, 'refused': 'error',
+                      'dns': True, 'dns timeout': False}
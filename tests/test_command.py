@@ -0,0 +1,20 @@
+from time import monotonic
+
+from host_monitor.command import Command
+
+
+def test_background_process_does_not_block():
+    command = Command('sh -c "sleep 30 & echo started"', 2)
+    start = monotonic()
+    command.run()
+    assert monotonic() - start < 1
+    assert command.success and not command.timed_out
+    assert command.output == 'started\n'
+
+
+def test_timeout_kills_process_group():
+    command = Command('sh -c "sleep 30 & sleep 30"', 0.5)
+    start = monotonic()
+    command.run()
+    assert monotonic() - start < 2
+    assert command.timed_out and not command.success
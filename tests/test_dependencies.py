@@ -0,0 +1,20 @@
+import re
+
+import pytest
+
+from conftest import run
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_children_unreachable_while_parent_down(home, workers):
+    # the internet monitor is down after 2 seconds, its child is suspended, the others keep being probed
+    groups = [[{'type': 'internet-monitor', 'address': '10.0.0.1#outage=1000:998'},
+               {'type': 'host', 'name': 'child', 'address': '10.0.0.2', 'depends_on': 'INTERNET'},
+               {'type': 'host', 'name': 'other', 'address': '10.0.0.3#flap=4'}]]
+    output = run(home(groups, probe_workers=workers), ['-m', 'host_monitor.main', '--headless'], timeout=12)
+    lines = re.findall(r'\d\d:\d\d:\d\d (\S+) (.*)', output)
+    assert ('0/child', 'up') in lines
+    down = lines.index(('0/INTERNET', 'down'))
+    assert ('0/child', 'unreachable (parent down)') in lines[down:]
+    assert ('0/child', 'down') not in lines
+    assert any(name == '0/other' for name, _ in lines[down:]), output
@@ -0,0 +1,20 @@
+from conftest import run
+
+coalesce_script = '''
+from host_monitor.gui import MainWindow
+from host_monitor.monitor import Monitor
+
+window = MainWindow(Monitor())
+host = window.monitor.hosts[(0, 'host')]
+for up in (True, False, True):
+    window.state_changed(host, up)
+window.flush_changes()
+print(window.toolTip().split(' (')[0])
+'''
+
+
+def test_coalesced_updates_are_shown(home):
+    groups = [[{'type': 'host', 'name': 'host', 'address': '10.0.0.1'}]]
+    # the running probe of host may add its own updates
+    count, text = run(home(groups), ['-c', coalesce_script], timeout=20).splitlines()[-1].split(' ', 1)
+    assert int(count) >= 2 and text == "state updates coalesced"
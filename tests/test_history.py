@@ -0,0 +1,49 @@
+import json
+
+from conftest import run
+
+resize_script = '''
+import json, os
+from host_monitor.history import RingFile, raw_record
+
+path = os.path.expanduser('~/ring')
+ring = RingFile(path, raw_record, 8)
+for index in range(10):
+    ring.append(index, index, 1)
+ring.close()
+sizes = []
+for capacity in (4, 16):
+    ring = RingFile(path, raw_record, capacity)
+    sizes.append([ring.capacity, [record[0] for record in ring.since(0)]])
+    ring.close()
+print(json.dumps(sizes))
+'''
+
+release_script = '''
+import json
+from time import sleep
+from host_monitor.history import get_store
+from host_monitor.registry import Registry
+
+registry = Registry()
+probe = registry.probe('10.0.0.1')
+while probe.history is None:
+    sleep(0.01)
+opened = len(get_store().histories)
+registry.release(probe)
+while get_store().histories:
+    sleep(0.01)
+print(json.dumps([opened, probe.history is None]))
+'''
+
+
+def test_history_is_resized(home):
+    # the newest records are kept when the capacity setting changes
+    home = home([], history_dir='~/history')
+    assert json.loads(run(home, ['-c', resize_script], timeout=20).splitlines()[-1]) == [
+        [4, [6, 7, 8, 9]], [16, [6, 7, 8, 9]]]
+
+
+def test_history_is_closed_when_its_probe_is_released(home):
+    home = home([], history_dir='~/history')
+    assert json.loads(run(home, ['-c', release_script], timeout=10).splitlines()[-1]) == [1, True]
@@ -0,0 +1,31 @@
+import json
+
+from conftest import run
+
+reload_script = '''
+import copy, json
+from host_monitor.config import config
+from host_monitor.monitor import Monitor
+
+def snapshot(monitor):
+    return {'hosts': {f"{group}/{name}": id(host) for (group, name), host in monitor.hosts.items()},
+            'users': {address: probe.users for address, probe in monitor.registry.probes.items()},
+            'observers': {address: len(probe.state_changed.observers)
+                          for address, probe in monitor.registry.probes.items()}}
+
+monitor = Monitor()
+before = snapshot(monitor)
+for _ in range(3):
+    monitor.apply(copy.deepcopy(config))
+print(json.dumps([before, snapshot(monitor)]))
+'''
+
+
+def test_reload_keeps_hosts_with_the_same_name_in_different_groups(home):
+    groups = [[{'type': 'host', 'name': 'google', 'address': '10.0.0.5'}],
+              [{'type': 'host', 'name': 'google', 'address': '10.0.0.5'},
+               {'type': 'host', 'name': 'other', 'address': '10.0.0.6'}],
+              [{'type': 'host', 'name': 'google', 'address': '10.0.0.7'}]]
+    before, after = json.loads(run(home(groups), ['-c', reload_script], timeout=20).splitlines()[-1])
+    assert after == before
+    assert before['users'] == {'10.0.0.5': 2, '10.0.0.6': 1, '10.0.0.7': 1}
@@ -0,0 +1,87 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+from host_monitor.resolver import Resolver, ResolveError, dns_header, read_resolv_conf
+
+
+class Nameserver(threading.Thread):
+    # answers A queries of the names in records, NXDOMAIN otherwise
+    def __init__(self, records):
+        super(Nameserver, self).__init__(daemon=True)
+        self.records = records
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.address = self.socket.getsockname()
+        self.queried = []
+
+    def run(self):
+        while True:
+            data, client = self.socket.recvfrom(512)
+            query_id = dns_header.unpack_from(data)[0]
+            offset, labels = dns_header.size, []
+            while data[offset]:
+                labels.append(data[offset + 1:offset + 1 + data[offset]].decode())
+                offset += 1 + data[offset]
+            name = '.'.join(labels)
+            self.queried.append(name)
+            question = data[dns_header.size:offset + 5]
+            ip = self.records.get(name)
+            if ip is None:
+                self.socket.sendto(dns_header.pack(query_id, 0x8183, 1, 0, 0, 0) + question, client)
+            else:
+                answer = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 60, 4) + socket.inet_aton(ip)
+                self.socket.sendto(dns_header.pack(query_id, 0x8180, 1, 1, 0, 0) + question + answer, client)
+
+
+def resolver(records, search=()):
+    nameserver = Nameserver(records)
+    nameserver.start()
+    resolver = Resolver([nameserver.address], hosts={})
+    resolver.search, resolver.ndots = list(search), 1
+    resolver.start()
+    return resolver, nameserver
+
+
+def test_read_resolv_conf(tmp_path):
+    path = tmp_path / 'resolv.conf'
+    path.write_text("nameserver 10.0.0.53\nnameserver ::1\ndomain old.example\nsearch lan corp.example.\n"
+                    "options ndots:2 timeout:1\n")
+    assert read_resolv_conf(str(path)) == ([('10.0.0.53', 53)], ['lan', 'corp.example'], 2)
+
+
+def test_short_names_use_the_search_domains():
+    resolver_, nameserver = resolver({'printer.corp.example': '10.1.2.3'}, search=['lan', 'corp.example'])
+    assert resolver_.lookup('printer', 5) == ('10.1.2.3',)
+    assert nameserver.queried == ['printer.lan', 'printer.corp.example']
+
+
+def test_unknown_names_fall_back_to_the_system_resolver():
+    resolver_, nameserver = resolver({})
+    assert resolver_.lookup('localhost', 5) == ('127.0.0.1',)
+    assert nameserver.queried == ['localhost']
+    with pytest.raises(ResolveError):
+        resolver_.lookup('does-not-exist.invalid', 10)
+
+
+def test_responses_from_other_addresses_are_ignored():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # the nameserver, it does not answer
+    silent.bind(('127.0.0.1', 0))
+    resolver_ = Resolver([silent.getsockname()], hosts={})
+    resolver_.timeout = 0.5
+    resolver_.start()
+    spoofer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    answer = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 60, 4) + socket.inet_aton('6.6.6.6')
+    question = b'\x06victim\x07example\x00\x00\x01\x00\x01'
+    results = []
+    done = threading.Event()
+    resolver_.resolve('victim.example', lambda name, ips, error: (results.append(ips), done.set()))
+    while not done.wait(0.05):
+        with resolver_.lock:
+            query_ids = list(resolver_.by_id)
+        for query_id in query_ids:
+            spoofer.sendto(dns_header.pack(query_id, 0x8180, 1, 1, 0, 0) + question + answer,
+                           resolver_.sockets[socket.AF_INET].getsockname())
+    assert results != [('6.6.6.6',)]
@@ -0,0 +1,32 @@
+import json
+
+from conftest import run
+
+interval_script = '''
+import json
+from time import monotonic
+from host_monitor.host import Probe
+from host_monitor.scheduler import Scheduler
+
+scheduler = Scheduler()
+probe = Probe('10.0.0.1')
+now = monotonic()
+scheduler.add(probe, now)
+intervals = [probe.interval]
+scheduler.due(monotonic())
+intervals.append(probe.interval)
+changed = [probe.update(True, 1.0)]  # first status
+changed += [probe.update(False) for _ in range(3)]  # down
+if changed[-1]:
+    scheduler.changed(probe)
+intervals.append(probe.interval)
+print(json.dumps([intervals, changed]))
+'''
+
+
+def test_new_hosts_start_at_probe_interval(home):
+    # probe_min_interval only after a state change, not for the first status after startup or reload
+    intervals, changed = json.loads(run(home([], probe_interval=1, probe_min_interval=0.5), ['-c', interval_script],
+                                        timeout=20).splitlines()[-1])
+    assert intervals == [1, 1, 0.5]
+    assert changed == [False, True, False, True]
@@ -0,0 +1,60 @@
+import json
+
+from conftest import run
+
+ring_script = '''
+import json, sys
+from threading import Thread
+from host_monitor.shards import Ring
+
+sys.setswitchinterval(1e-6)  # interleave the producers as much as possible
+threads, count = 8, 5000
+ring = Ring(threads * count)
+received = []
+
+def produce(slot):
+    for i in range(count):
+        ring.put(slot, 1, i)
+
+producers = [Thread(target=produce, args=(slot,)) for slot in range(threads)]
+for thread in producers:
+    thread.start()
+while True:
+    running = any(thread.is_alive() for thread in producers)
+    received.extend(ring.get())
+    if not running:
+        break
+rtts = {}
+for slot, status, rtt in received:
+    rtts.setdefault(slot, []).append(rtt)
+print(json.dumps([ring.dropped, all(rtts.get(slot) == list(range(count)) for slot in range(threads))]))
+ring.close(unlink=True)
+'''
+
+
+def test_ring_keeps_the_updates_of_concurrent_producers(home):
+    # probes of a worker put updates from the engine, resolver and ping subprocess threads
+    assert json.loads(run(home([]), ['-c', ring_script], timeout=60).splitlines()[-1]) == [0, True]
+
+worker_rate_script = '''
+from multiprocessing import get_context
+
+def print_rate():
+    from host_monitor.scheduler import Scheduler
+    bucket = Scheduler().bucket
+    print(bucket.rate, bucket.tokens, flush=True)
+
+if __name__ == '__main__':
+    print_rate()
+    process = get_context('spawn').Process(target=print_rate)
+    process.start()
+    process.join()
+'''
+
+
+def test_workers_share_the_rate_limit(home, tmp_path):
+    # probe_workers processes with a global bucket each must not send more than probe_rate_limit together
+    script = tmp_path / 'rate.py'
+    script.write_text(worker_rate_script)
+    output = run(home([], probe_workers=4, probe_rate_limit=200, probe_startup_burst=1000), [str(script)], timeout=20)
+    assert output.split() == ['200.0', '1000.0', '50.0', '250.0']
@@ -0,0 +1,22 @@
+import json
+
+from conftest import run
+
+outage_script = '''
+import json
+from host_monitor.host import Probe
+
+probe = Probe('10.0.0.1')
+states = []
+probe.state_changed.subscribe(lambda probe, state: states.append(state))
+for ping_success in [True] * 30 + [False] * 10 + [True] * 5 + [False] + [True] * 30:
+    probe.update(ping_success, 1.0 if ping_success else None)
+print(json.dumps(states))
+'''
+
+
+def test_outage_is_not_degraded(home):
+    # up -> down -> up, not degraded while the first pings are lost nor after the outage, a single lost ping
+    # (1 of loss_window 20) neither
+    states = json.loads(run(home([]), ['-c', outage_script], timeout=20).splitlines()[-1])
+    assert states == [True, False, True]
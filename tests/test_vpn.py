@@ -0,0 +1,27 @@
+import pytest
+
+from conftest import run
+from host_monitor.addresses import get_local_addresses
+
+
+def test_running_vpn_is_not_connected_again(home):
+    # the VPN address is assigned already, the first status of its pinger decides instead of a connect command
+    addresses = get_local_addresses().get()
+    if not addresses:
+        pytest.skip("no local address to stand in for the VPN address")
+    groups = [[{'type': 'internet-monitor', 'address': '10.0.0.1'},
+               {'type': 'vpn', 'name': 'vpn', 'mode': 'auto', 'assigned_ip': min(addresses),
+                'ping_ip': '10.0.0.2#latency=300', 'exclude_ips': [], 'connect': 'echo CONNECT-RAN',
+                'disconnect': 'echo DISCONNECT-RAN'}]]
+    output = run(home(groups), ['-m', 'host_monitor.main', '--headless', '-v'], timeout=4)
+    assert '0/vpn connected' in output
+    assert 'CONNECT-RAN' not in output and 'Starting VPN' not in output
+
+
+def test_connecting_vpn_is_logged_as_connecting(home):
+    groups = [[{'type': 'internet-monitor', 'address': '10.0.0.1'},
+               {'type': 'vpn', 'name': 'vpn', 'mode': 'auto', 'assigned_ip': '10.255.0.1', 'ping_ip': '10.0.0.2',
+                'exclude_ips': [], 'connect': 'sleep 30', 'disconnect': 'true'}]]
+    output = run(home(groups), ['-m', 'host_monitor.main', '--headless'], timeout=4)
+    assert '0/vpn connecting' in output
+    assert '0/vpn unknown' not in output